@@ -0,0 +1,4 @@
+@echo off
+set CANNONBALL_ROOT=%0\..\..
+set PYTHONPATH=%PYTHONPATH%:%CANNONBALL_ROOT%\lib
+python -m cannonball.compile %*
\ No newline at end of file
@@ -1,83 +1,186 @@
 from __future__ import division
 
+from cannonball.LevelCompiler import *
+from cannonball.LevelData import *
+from cannonball.MaterialTable import material_table
 from cannonball.svg import *
 
 from Box2D import *
+import numpy
 from pyglet.gl import *
 
 import math
 import random
 
+# Collision categories, set as the Box2D filter category bits of each shape.
+# They do not change which shapes collide. Level.add_contact checks them in
+# Python, to decide which contacts are reported to actors.
+default_category = 0x0001
+cannonball_category = 0x0002
+grenade_category = 0x0004
+pickup_category = 0x0008
+all_categories = 0xffff
+
 class Actor(object):
+    """
+    A body in a level.
+
+    Contacts are reported to `collide` only for other shapes whose category
+    is in the actor's `contact_mask`. The default is none.
+
+    Actors of pooled classes are parked when destroyed, keeping their body
+    and display list, and are reused by `Level.create_actor`.
+
+    The user data of each shape is a material id and the offset of the
+    shape's vertex normals in the actor's `normals` array, or None if the
+    shape has no normals.
+    """
+
+    __slots__ = ('level', 'serial', 'id', 'body', 'meshes', 'normals',
+                 'local_box', 'display_list', 'dirty_display_list', 'parked')
+
     z = 0
+    category = default_category
+    contact_mask = 0
+    pooled = False
 
     def __init__(self, level):
         self.level = level
+        self.serial = level.serials.next()
+        level.add_contact_mask(self.category, self.contact_mask)
         self.id = None
         self.body = None
-        self.display_list = glGenLists(1)
+        self.meshes = []
+        self.normals = None
+        self.local_box = None
+        self.display_list = None
         self.dirty_display_list = True
+        self.parked = False
+
+    @classmethod
+    def compile(cls, compiler, element, transform):
+        body_data = BodyData(get_attribute(element, 'id'), get_actor_name(cls))
+        compiler.compile_shapes(body_data, element, transform)
+        compiler.data.bodies.append(body_data)
 
-    def load(self, element, transform):
+    def load(self, body_data):
         body_def = b2BodyDef()
         self.body = self.level.world.CreateBody(body_def)
         self.body.SetUserData(self)
-        self.load_shapes(element, transform)
+        self.normals = numpy.array([normal for shape_data in body_data.shapes
+                                    for normal in shape_data.normals],
+                                   dtype=numpy.float32).reshape(-1, 3)
+        normals_start = 0
+        for shape_data in body_data.shapes:
+            self.load_shape(shape_data, normals_start)
+            normals_start += len(shape_data.normals)
         self.body.SetMassFromShapes()
+        self.meshes = body_data.meshes
+        if self.meshes:
+            self.level.renderer.add_actor(self)
 
-    def load_shapes(self, element, transform):
-        transform = transform * Transform(element.getAttribute('transform'))
-        if element.nodeName == 'g':
-            for child in node.childNodes:
-                if child.nodeName in ('g', 'path'):
-                    self.load_shapes(child, transform)
-        elif element.nodeName == 'path':
-            self.load_shape(element, transform)
-
-    def load_shape(self, element, transform):
-        data = self.level.parse_element_data(element)
-        color = Color('#ffffff')
-        texture = None
-        fill = data.get('fill')
-        if fill.startswith('#'):
-            color = Color(fill)
-        elif fill.startswith('url(#') and fill.endswith(')'):
-            pattern_id = fill.lstrip('url(#').rstrip(')')
-            image_path = get_image_path(element.ownerDocument, pattern_id)
-            texture = self.level.get_texture(image_path)
-        path = Path(element.getAttribute('d'))
-        for subpath in path.subpaths:
-            polygon = subpath.linearize()
-            polygon = Polygon(transform * v for v in polygon.vertices)
-            polygon = polygon.normalize()
-            normal_dict = {}
-            vertices = list(polygon)
-            for i, vertex in enumerate(vertices):
-                before = vertex - vertices[(i - 1) % len(vertices)]
-                after = vertices[(i + 1) % len(vertices)] - vertex
-                normal = (before.perp().norm() + after.perp().norm()).norm()
-                normal = Vector(tuple(normal) + (0.001,)).norm()
-                normal_dict[vertex] = normal
-            for triangle in polygon.triangulate():
-                normals = [normal_dict[v] for v in triangle]
-                shape_def = b2PolygonDef()
-                shape_def.vertices = map(tuple, triangle)
-                if data.get('sensor') == 'true':
-                    shape_def.isSensor = True
-                shape_def.density = float(data.get('density', '0'))
-                shape = self.body.CreateShape(shape_def)
-                shape.SetUserData(dict(color=tuple(c / 255 for c in color),
-                                       texture=texture, normals=normals))
+    def load_shape(self, shape_data, normals_start=None):
+        shape_def = b2PolygonDef()
+        shape_def.vertices = shape_data.vertices
+        if shape_data.sensor:
+            shape_def.isSensor = True
+        shape_def.density = shape_data.density
+        shape_def.filter.categoryBits = self.category
+        shape = self.body.CreateShape(shape_def)
+        self.set_material(shape, shape_data.color, shape_data.texture,
+                          normals_start)
+
+    def set_material(self, shape, color, texture=None, normals_start=None):
+        shape.SetUserData((material_table.intern(color, texture),
+                           normals_start))
 
     def collide(self, other):
         pass
 
+    def activate(self, position, angle=0):
+        """
+        Reset a parked actor with the arguments that the class takes after
+        the level. By default, the body is unparked at a position.
+        """
+        self.unpark(position, angle)
+
+    def park(self, position):
+        """
+        Move the body to a parking position, stop all its collisions and put
+        it to sleep, so that Box2D skips it until it is unparked.
+        """
+        self.parked = True
+        self.body.SetXForm(position, 0)
+        self.set_mask_bits(0)
+        self.body.PutToSleep()
+
+    def unpark(self, position, angle=0):
+        self.parked = False
+        self.body.SetXForm(position, angle)
+        self.set_mask_bits(all_categories)
+        self.body.WakeUp()
+
+    def set_mask_bits(self, mask_bits):
+        for shape in self.body.shapeList:
+            filter_data = shape.GetFilterData()
+            filter_data.maskBits = mask_bits
+            shape.SetFilterData(filter_data)
+            self.level.world.Refilter(shape)
+
+    def get_local_box(self):
+        """
+        Return the bounding box of all shapes in body coordinates.
+        """
+        if self.local_box is None:
+            boxes = [get_shape_box(shape) for shape in self.body.shapeList]
+            boxes = [box for box in boxes if box] or [(0, 0, 0, 0)]
+            self.local_box = (min(box[0] for box in boxes),
+                              min(box[1] for box in boxes),
+                              max(box[2] for box in boxes),
+                              max(box[3] for box in boxes))
+        return self.local_box
+
+    def get_box(self):
+        """
+        Return a bounding box of the body in world coordinates.
+        """
+        min_x, min_y, max_x, max_y = self.get_local_box()
+        p = self.body.position
+        c, s = math.cos(self.body.angle), math.sin(self.body.angle)
+        cx, cy = (min_x + max_x) / 2, (min_y + max_y) / 2
+        hx, hy = (max_x - min_x) / 2, (max_y - min_y) / 2
+        x, y = p.x + c * cx - s * cy, p.y + s * cx + c * cy
+        ex, ey = abs(c) * hx + abs(s) * hy, abs(s) * hx + abs(c) * hy
+        return x - ex, y - ey, x + ex, y + ey
+
+    def get_shape_boxes(self):
+        """
+        Return the bounding box of each shape in world coordinates.
+        """
+        p = self.body.position
+        c, s = math.cos(self.body.angle), math.sin(self.body.angle)
+        boxes = []
+        for shape in self.body.shapeList:
+            polygon = shape.asPolygon()
+            circle = shape.asCircle()
+            if polygon:
+                xs, ys = zip(*[(p.x + c * x - s * y, p.y + s * x + c * y)
+                               for x, y in polygon.vertices])
+                boxes.append((min(xs), min(ys), max(xs), max(ys)))
+            elif circle:
+                lp = circle.localPosition
+                x, y = p.x + c * lp.x - s * lp.y, p.y + s * lp.x + c * lp.y
+                r = circle.radius
+                boxes.append((x - r, y - r, x + r, y + r))
+        return boxes
+
     def draw(self):
         glPushMatrix()
-        p = self.body.GetPosition()
-        a = self.body.GetAngle()
-        glTranslated(p.x, p.y, 0)
+        x, y, a = self.level.get_transform(self)
+        glTranslated(x, y, 0)
         glRotated(a * 180 / math.pi, 0, 0, 1)
+        if self.display_list is None:
+            self.display_list = glGenLists(1)
         if self.dirty_display_list:
             self.dirty_display_list = False
             glNewList(self.display_list, GL_COMPILE_AND_EXECUTE)
@@ -88,22 +191,27 @@ class Actor(object):
         glPopMatrix()
 
     def draw_geometry(self):
+        # Actors with meshes are drawn by the level renderer.
         for shape in self.body.shapeList:
             self.draw_shape(shape)
 
     def draw_shape(self, shape):
-        data = shape.GetUserData() or {}
-        texture = data.get('texture')
-        if texture:
+        material_id, normals_start = shape.GetUserData()
+        material = material_table[material_id]
+        texture = None
+        if material.texture:
+            texture = self.level.get_texture(material.texture)
             glColor3d(1, 1, 1)
         else:
-            texture = None
-            color = data.get('color', (1, 1, 1))
-            glColor3d(*color)
+            glColor3d(*material.color)
         polygon = shape.asPolygon()
         circle = shape.asCircle()
         if polygon:
-            self.draw_polygon(polygon, data.get('normals'), texture)
+            normals = None
+            if normals_start is not None:
+                normals = self.normals[normals_start:normals_start +
+                                       len(polygon.vertices)].tolist()
+            self.draw_polygon(polygon, normals, texture)
         elif circle:
             glPushMatrix()
             p = circle.localPosition
@@ -142,14 +250,18 @@ class Actor(object):
         if texture:
             glDisable(texture.target)
 
-def get_image_path(document, pattern_id):
-    pattern_elements = document.getElementsByTagName('pattern')
-    pattern_element = [e for e in pattern_elements
-                       if e.getAttribute('id') == pattern_id][0]
-    if pattern_element.getAttribute('xlink:href'):
-        pattern_id = pattern_element.getAttribute('xlink:href').lstrip('#')
-        return get_image_path(document, pattern_id)
-    image_elements = pattern_element.getElementsByTagName('image')
-    if image_elements:
-        return image_elements[0].getAttribute('xlink:href')
+def get_shape_box(shape):
+    """
+    Return the bounding box of a shape in body coordinates, or None for
+    other shapes than polygons and circles.
+    """
+    polygon = shape.asPolygon()
+    circle = shape.asCircle()
+    if polygon:
+        xs, ys = zip(*polygon.vertices)
+        return min(xs), min(ys), max(xs), max(ys)
+    elif circle:
+        p = circle.localPosition
+        r = circle.radius
+        return p.x - r, p.y - r, p.x + r, p.y + r
     return None
@@ -4,13 +4,27 @@ from Box2D import *
 import pyglet
 from pyglet.gl import *
 
+from bisect import bisect_left
 import math
 from operator import attrgetter
 
 class Camera(object):
+    """
+    Follows the cannonball and draws the part of the level that is in view.
+
+    The camera keeps the actors drawn individually in a list ordered by z.
+    The list covers a query rectangle padded around the view. The level's
+    spatial index is only queried when the view leaves the query rectangle.
+    Otherwise only the bodies that moved in the last physics step are
+    checked against it, and destroyed actors are dropped as they are found.
+    """
+
     min_scale = 10
     max_scale = 50
 
+    # Padding of the query rectangle, as a fraction of the view size.
+    padding = 0.25
+
     def __init__(self, window, level):
         self.window = window
         self.level = level
@@ -21,6 +35,12 @@ class Camera(object):
         self.zooming_in = False
         self.zooming_out = False
 
+        self.query_rect = None
+        self.visible = []
+        self.sorted_keys = []
+        self.visible_keys = {}
+        self.query_result = []
+
     def step(self, dt):
         if self.zooming_in:
             self.scale *= 10 ** dt
@@ -32,7 +52,7 @@ class Camera(object):
 
         cannonball = self.level.actors.get('cannonball')
         if cannonball:
-            self.position = cannonball.body.position.tuple()
+            self.position = self.level.get_transform(cannonball)[:2]
 
     def draw(self):
         x, y = self.position
@@ -63,21 +83,85 @@ class Camera(object):
         glOrtho(min_x, max_x, min_y, max_y, -1, 1)
         glMatrixMode(GL_MODELVIEW)
 
+        profiler = self.level.profiler
+        profiler.start('background')
         self.draw_background(min_x, min_y, max_x, max_y)
-
-        query_aabb = b2AABB()
-        query_aabb.lowerBound = min_x, min_y
-        query_aabb.upperBound = max_x, max_y
-        count, shapes = self.level.world.Query(query_aabb, 1000)
-        actors = set(s.GetBody().userData for s in shapes)
-        def key(actor):
-            return actor.z, id(actor)
-        for actor in sorted(actors, key=key):
-            glNormal3d(0, 0, 1)
-            actor.draw()
+        profiler.stop('background')
+        profiler.start('meshes')
+        glNormal3d(0, 0, 1)
+        self.level.renderer.draw(min_x, min_y, max_x, max_y)
+        profiler.stop('meshes')
+
+        profiler.start('visibility')
+        self.update_visible(min_x, min_y, max_x, max_y)
+        profiler.stop('visibility')
+        profiler.start('draw')
+        destroyed = []
+        for actor in self.visible:
+            if actor.body is None or actor.parked:
+                destroyed.append(actor)
+            else:
+                glNormal3d(0, 0, 1)
+                actor.draw()
+        for actor in destroyed:
+            self.remove_visible(actor)
+        self.level.particles.draw()
+        profiler.stop('draw')
+        profiler.count('drawn_actors', len(self.visible))
+
+    def update_visible(self, min_x, min_y, max_x, max_y):
+        rect = self.query_rect
+        if (rect is None or min_x < rect[0] or min_y < rect[1] or
+            max_x > rect[2] or max_y > rect[3]):
+            padding_x = self.padding * (max_x - min_x)
+            padding_y = self.padding * (max_y - min_y)
+            self.query_rect = (min_x - padding_x, min_y - padding_y,
+                               max_x + padding_x, max_y + padding_y)
+            self.query_visible()
+        else:
+            for actor in self.level.previous_transforms:
+                if actor is not None and not actor.meshes:
+                    if (actor.body is not None and not actor.parked and
+                        self.overlaps(actor)):
+                        self.add_visible(actor)
+                    else:
+                        self.remove_visible(actor)
+
+    def query_visible(self):
+        min_x, min_y, max_x, max_y = self.query_rect
+        actors = self.level.index.query(min_x, min_y, max_x, max_y,
+                                        self.query_result)
+        del self.visible[:]
+        del self.sorted_keys[:]
+        self.visible_keys.clear()
+        for actor in actors:
+            if not actor.meshes:
+                self.add_visible(actor)
+
+    def overlaps(self, actor):
+        min_x, min_y, max_x, max_y = self.query_rect
+        box = actor.get_box()
+        return (box[2] >= min_x and box[0] <= max_x and
+                box[3] >= min_y and box[1] <= max_y)
+
+    def add_visible(self, actor):
+        if actor not in self.visible_keys:
+            key = actor.z, actor.serial
+            self.visible_keys[actor] = key
+            i = bisect_left(self.sorted_keys, key)
+            self.sorted_keys.insert(i, key)
+            self.visible.insert(i, actor)
+
+    def remove_visible(self, actor):
+        key = self.visible_keys.pop(actor, None)
+        if key is not None:
+            i = bisect_left(self.sorted_keys, key)
+            del self.sorted_keys[i]
+            del self.visible[i]
 
     def draw_background(self, min_x, min_y, max_x, max_y):
-        if self.level.background:
+        background = self.level.get_background()
+        if background:
             world_aabb = self.level.world.GetWorldAABB()
             world_width = world_aabb.upperBound.x
             world_height = world_aabb.upperBound.y
@@ -85,9 +169,8 @@ class Camera(object):
             weight = 0.2
 
             glDisable(GL_LIGHTING)
-            glEnable(self.level.background.target)
-            glBindTexture(self.level.background.target,
-                          self.level.background.id)
+            glEnable(background.target)
+            glBindTexture(background.target, background.id)
 
             glColor3d(1, 1, 1)
             glBegin(GL_QUADS)
@@ -103,7 +186,7 @@ class Camera(object):
             glVertex2d((max_x + weight * world_width) / (weight + 1),
                        min_y / (weight + 1))
             glEnd()
-            glDisable(self.level.background.target)
+            glDisable(background.target)
             glEnable(GL_LIGHTING)
 
     def on_key_press(self, symbol, modifiers):
@@ -3,6 +3,16 @@ from __future__ import division
 
 # Project imports.
 from cannonball.Actor import Actor
+from cannonball.actors.Cannonball import Cannonball
+from cannonball.geometry import cluster_circles, polygon_distance
+from cannonball.LevelCompiler import *
+from cannonball.memory import get_memory_report
+from cannonball.ParticleSystem import ParticleSystem
+from cannonball.Profiler import Profiler
+from cannonball.Renderer import Renderer
+from cannonball.SpatialIndex import SpatialIndex
+from cannonball.TextureManager import texture_manager
+from cannonball.TimerWheel import TimerWheel
 from cannonball.svg import *
 
 # Third party imports.
@@ -11,128 +21,428 @@ from pyglet.gl import *
 from Box2D import *
 
 # Standard library imports.
+from collections import OrderedDict
+from itertools import count
 from math import *
+from operator import attrgetter
 import os
+import random
 import sys
-from xml.dom import minidom
+
+def linear_falloff(t):
+    return 1 - t
+
+def constant_falloff(t):
+    return 1
+
+def step_falloff(t):
+    """
+    The full impulse in the inner half of the radius and half of it in the
+    outer half, as from two flat shock waves with half the impulse each.
+
+    >>> [100 * step_falloff(d / 2) for d in (0, 0.5, 1, 1.5, 1.9)]
+    [100, 100, 100, 50.0, 50.0]
+    """
+    return 1 if t <= 0.5 else 0.5
 
 class Level(object):
-    def __init__(self, path):
+    """
+    A level world and its actors.
+
+    GL resources are created lazily on first draw, so a level can be loaded
+    and stepped without a window or GL context.
+
+    Stepping is deterministic for a given seed and sequence of inputs:
+    actors draw from the level's random number generator, and contacts and
+    destruction are handled in a fixed order. Delayed events are scheduled
+    in physics steps on a timer wheel, not on pyglet's clock.
+
+    Contacts are filtered by the Box2D filter categories of their shapes
+    and the contact masks of the actor classes. Box2D has no native filter
+    for contact reports, only for collisions, so every new contact point
+    still calls into Python. Contacts that no actor listens to are dropped
+    there, before their bodies are looked up. The rest are collected
+    during the physics step and delivered in one batch after it.
+    Explosions are queued in the same way and resolved after the contacts,
+    with one query for each cluster of overlapping explosions.
+
+    Area queries go through a spatial index of actors that the level owns,
+    instead of the Box2D broadphase, so that results are bodies, not
+    shapes, and are never truncated. Actors that moved in a step are
+    updated in the index after it. Parked actors are not in the index.
+
+    Dynamic bodies far from the cannonball are frozen: their velocities are
+    saved and they are put to sleep, so that Box2D skips them. They are
+    woken up with their saved velocities when the cannonball comes near
+    again. A body that a contact, joint or impulse wakes up first gets its
+    saved velocity back too. Bodies connected by joints are frozen together.
+    Freezing depends only on the simulation, not on the camera, so it does
+    not break replays.
+    """
+
+    # Dynamic bodies are frozen when they are farther than this from the
+    # cannonball along either axis, and thawed when they are closer than
+    # the thaw distance. The view is 30 m high. None disables freezing.
+    freeze_distance = 50
+    thaw_distance = 40
+
+    # Physics steps between passes over the awake and frozen bodies.
+    freeze_interval = 15
+
+    # Parked actors are kept inside the world bounds, where Box2D can still
+    # move them. Their shapes do not collide with anything.
+    parking_position = 1, 1
+
+    def __init__(self, path, data=None, seed=None, progress=None):
         self.path = path
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.serials = count()
         self.time = 0
+        self.dt = 1 / 60
+        self.steps = 0
         self.actors = {}        
         self.background_color = 0, 0, 0
-        self.joints = []
         self.destroying = set()
-        self.contacts = set()
-        self.textures = {}
-        self.load(path)
-        background_path = os.path.dirname(os.path.dirname(self.path))
-        background_path = os.path.join(background_path, 'textures',
-                          'clouds.jpg')
-        try:
-            self.background = pyglet.image.load(background_path).get_texture()
-        except:
-            self.background = None
+        self.frozen = {}
+        self.pools = {}
+        self.explosions = []
+        self.index = SpatialIndex()
+        self.query_result = []
+        self.timers = TimerWheel()
+        self.contacts = OrderedDict()
+        self.contact_masks = {}
+        self.previous_transforms = {}
+        self.interpolation = 1
+        self.renderer = Renderer(self)
+        self.particles = ParticleSystem(self)
+        self.profiler = Profiler()
+        self.background = None
+        self.circle_display_list = None
+        self.load(path, data, progress)
         self.contact_listener = CannonballContactListener(self)
         self.world.SetContactListener(self.contact_listener)
 
         self.boundary_listener = CannonballBoundaryListener(self)
         self.world.SetBoundaryListener(self.boundary_listener)
 
-        self.circle_display_list = glGenLists(1)
-        glNewList(self.circle_display_list, GL_COMPILE)
-        self._draw_circle()
-        glEndList()
-
-    def load(self, path):
-        document = minidom.parse(path)
-        root = [n for n in document.childNodes if n.nodeName == 'svg'][0]
-        named_view = root.getElementsByTagName('sodipodi:namedview')[0]
-        page_color = Color(named_view.getAttribute('pagecolor') or '#000000')
-        scale = get_scale(document)
-        width = float(root.getAttribute('width')) * scale
-        height = float(root.getAttribute('height')) * scale
+    def load(self, path, data=None, progress=None):
+        """
+        Create the world and its actors. If given, `progress` is called with
+        the number of bodies created so far and the total.
+        """
+        if data is None:
+            data = load_level_data(path)
         aabb = b2AABB()
         aabb.lowerBound = 0, 0
-        aabb.upperBound = width, height
+        aabb.upperBound = data.width, data.height
         gravity = 0, -10
         doSleep = True
         self.world = b2World(aabb, gravity, doSleep)
-        self.background_color = tuple(c / 255 for c in page_color)
-        transform = Transform('translate(0 %g) scale(%g) scale(1 -1)' %
-                              (height, scale))
-        load_layers(self, root, transform)
-        for joint_position in self.joints:
-            joint_aabb = b2AABB()
-            joint_aabb.lowerBound = joint_position
-            joint_aabb.upperBound = joint_position
-            count, shapes = self.world.Query(joint_aabb, 1000)
-            bodies = set(s.GetBody() for s in shapes)
-            if len(bodies) == 2:
-                body_1, body_2 = bodies
+        self.background_color = data.background_color
+        self.triangle_count = data.triangle_count
+        self.shape_count = data.shape_count
+        for i, body_data in enumerate(data.bodies):
+            actor = get_actor_class(body_data.actor_name)(self)
+            actor.id = body_data.id
+            self.actors[actor.id] = actor
+            actor.load(body_data)
+            self.index.add(actor, actor.get_shape_boxes())
+            if progress:
+                progress(i + 1, len(data.bodies))
+
+        # A joint connects the two bodies with a shape whose bounding box
+        # contains the joint position, if there are exactly two.
+        actors = self.query_result
+        for x, y in data.joints:
+            self.index.query(x, y, x, y, actors)
+            if len(actors) == 2:
+                actor_1, actor_2 = actors
                 joint_def = b2RevoluteJointDef()
-                joint_def.Initialize(body_1, body_2, joint_position)
+                joint_def.Initialize(actor_1.body, actor_2.body, (x, y))
                 self.world.CreateJoint(joint_def)
 
-    def get_texture(self, path):
-        if path not in self.textures:
-            p = path
-            if not os.path.isabs(p):
-                p = os.path.join(os.path.dirname(self.path), p)
-            image = pyglet.image.load(p)
-            self.textures[path] = image.get_texture()
-        return self.textures[path]
+    def get_background(self):
+        if self.background is None:
+            try:
+                self.background = texture_manager.get_texture(
+                    self.get_background_path())
+            except:
+                self.background = False
+        return self.background
+
+    def get_background_path(self):
+        background_path = os.path.dirname(os.path.dirname(self.path))
+        return os.path.join(background_path, 'textures', 'clouds.jpg')
+
+    def get_start_position(self):
+        start_shapes = self.actors['start'].body.shapeList
+        start_position = b2Vec2()
+        for shape in start_shapes:
+            start_position += shape.GetCentroid()
+        start_position *= 1 / len(start_shapes)
+        return start_position
+
+    def create_actor(self, cls, *args):
+        """
+        Create an actor of the given class, reusing a parked one if the
+        class is pooled.
+        """
+        pool = self.pools.get(cls)
+        if pool:
+            actor = pool.pop()
+            actor.serial = self.serials.next()
+            actor.activate(*args)
+        else:
+            actor = cls(self, *args)
+        self.index.move(actor, actor.get_box())
+        return actor
+
+    def create_cannonball(self, position=None):
+        if position is None:
+            position = self.get_start_position()
+        actor = Cannonball(self)
+        actor.create_body(position)
+        self.index.move(actor, actor.get_box())
+        return actor
+
+    def get_memory_report(self):
+        """
+        Return the measured memory of the level's actors and shape data,
+        and of the same data in the layout it had before materials were
+        interned and classes got slots.
+        """
+        return get_memory_report(self)
+
+    def get_texture(self, path, atlas=False):
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(self.path), path)
+        return texture_manager.get_texture(path, atlas)
 
     def step(self, dt):
+        profiler = self.profiler
+        self.dt = dt
         self.time += dt
+
+        # Timers expire before anything else runs, so that a timer
+        # scheduled during a step never expires in the same step.
+        profiler.start('timers')
+        for timer in self.timers.advance():
+            timer.callback(*timer.args)
+        profiler.stop('timers')
         cannonball = self.actors.get('cannonball')
         if cannonball:
+            profiler.start('cannonball')
             cannonball.step(dt)
+            profiler.stop('cannonball')
 
         velocityIterations = 10
         positionIterations = 8
         self.contacts.clear()
+        self.save_transforms()
+        if self.steps % self.freeze_interval == 0:
+            profiler.start('freeze')
+            self.update_frozen()
+            profiler.stop('freeze')
+        self.steps += 1
+        profiler.start('world_step')
         self.world.Step(dt, velocityIterations, positionIterations)
-        for actor_1, actor_2 in self.contacts:
-            actor_1.collide(actor_2)
-            actor_2.collide(actor_1)
-        for actor in self.destroying:
+        profiler.stop('world_step')
+        profiler.start('contacts')
+        self.dispatch_contacts()
+        profiler.stop('contacts')
+        if self.explosions:
+            profiler.start('explosions')
+            self.resolve_explosions()
+            profiler.stop('explosions')
+        profiler.start('particles')
+        self.particles.step(dt)
+        profiler.stop('particles')
+        profiler.start('destroy')
+        for actor in sorted(self.destroying, key=attrgetter('serial')):
+            self.frozen.pop(actor, None)
+
+            # Bodies that left the world are frozen by Box2D for good.
+            self.index.remove(actor)
+            if actor.pooled and actor.body and not actor.body.IsFrozen():
+                actor.park(self.parking_position)
+                self.pools.setdefault(type(actor), []).append(actor)
+                continue
             if actor.body:
                 self.world.DestroyBody(actor.body)
                 actor.body = None
                 if actor.id:
                     del self.actors[actor.id]
+            if actor.meshes:
+                self.renderer.remove_actor(actor)
             if actor.display_list is not None:
                 glDeleteLists(actor.display_list, 1)
                 actor.display_list = None
         self.destroying.clear()
+        profiler.stop('destroy')
+        profiler.start('index')
+        self.update_index()
+        profiler.stop('index')
+        profiler.count('bodies', self.world.GetBodyCount())
+        profiler.count('shapes', self.world.GetProxyCount())
+        profiler.count('contacts', self.world.GetContactCount())
+        profiler.count('collisions', len(self.contacts))
+        profiler.count('particles', self.particles.count)
+        profiler.count('frozen', len(self.frozen))
+        profiler.count('timers', len(self.timers))
+
+    def update_index(self):
+        # Bodies that were awake before the step are the ones that can have
+        # moved. Bodies woken up during the step moved less than the margin
+        # of the index.
+        for actor in self.previous_transforms:
+            if actor is not None and actor.body and not actor.parked:
+                self.index.move(actor, actor.get_box())
+
+    def save_transforms(self):
+        self.previous_transforms.clear()
+        for body in self.world.bodyList:
+            if not body.IsStatic() and not body.IsSleeping():
+                p = body.position
+                self.previous_transforms[body.userData] = p.x, p.y, body.angle
+
+    def update_frozen(self):
+        cannonball = self.actors.get('cannonball')
+        if self.freeze_distance is None or not cannonball:
+            return
+        position = cannonball.body.position
+        x, y = position.x, position.y
+        for actor, velocity in self.frozen.items():
+            body = actor.body
+            if not body.IsSleeping():
+                # Woken up by a contact, a joint or an impulse.
+                thaw_body(body, velocity)
+                del self.frozen[actor]
+            elif not is_far(body, x, y, self.thaw_distance):
+                body.WakeUp()
+                thaw_body(body, velocity)
+                del self.frozen[actor]
+
+        # Bodies that moved in the last step are the awake dynamic bodies.
+        for actor in self.previous_transforms.keys():
+            if actor is None or actor is cannonball or actor in self.frozen:
+                continue
+            bodies = get_jointed_bodies(actor.body)
+            if all(is_far(body, x, y, self.freeze_distance)
+                   for body in bodies):
+                for body in bodies:
+                    self.freeze(body.userData)
+
+    def freeze(self, actor):
+        body = actor.body
+        if actor in self.frozen or body.IsSleeping():
+            return
+        self.frozen[actor] = freeze_body(body)
+
+    def get_transform(self, actor):
+        """
+        Return the position and angle of an actor's body, interpolated
+        between the last two physics steps for drawing.
+        """
+        p = actor.body.position
+        angle = actor.body.angle
+        previous = self.previous_transforms.get(actor)
+        if previous is None or self.interpolation >= 1:
+            return p.x, p.y, angle
+        t = self.interpolation
+        x, y, a = previous
+        return x + t * (p.x - x), y + t * (p.y - y), a + t * (angle - a)
+
+    def dispatch_contacts(self):
+        for actor, other in self.contacts:
+            actor.collide(other)
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call a callback with the given arguments in the first step at least
+        `delay` seconds of level time from now. Return a timer that can be
+        passed to `cancel`.
+        """
+        ticks = int(ceil(delay / self.dt - 1e-9))
+        return self.timers.schedule(ticks, callback, *args)
+
+    def cancel(self, timer):
+        self.timers.cancel(timer)
 
     def queue_destroy(self, actor, delay):
-        def destroy(dt):
-            self.destroying.add(actor)
-        pyglet.clock.schedule_once(destroy, delay)
+        return self.schedule(delay, self.destroying.add, actor)
 
-    def add_contact(self, point):
-        actor_1 = point.shape1.GetBody().GetUserData()
-        actor_2 = point.shape2.GetBody().GetUserData()
-        if actor_1 and actor_2:
-            self.contacts.add((actor_1, actor_2))
+    def explode(self, position, radius, impulse, falloff=linear_falloff):
+        """
+        Queue an explosion that pushes dynamic bodies away from a position.
+        A body at distance d from the center gets an impulse of
+        `impulse * falloff(d / radius)`, where d is measured to the nearest
+        point of the body's shapes.
+        """
+        x, y = tuple(position)
+        self.explosions.append((x, y, radius, impulse, falloff))
+
+    def resolve_explosions(self):
+        explosions = self.explosions
+        self.explosions = []
+        for indices in cluster_circles([e[:3] for e in explosions]):
+            cluster = [explosions[i] for i in indices]
+            actors = self.index.query(
+                min(x - r for x, y, r, _, _ in cluster),
+                min(y - r for x, y, r, _, _ in cluster),
+                max(x + r for x, y, r, _, _ in cluster),
+                max(y + r for x, y, r, _, _ in cluster), self.query_result)
+            for actor in actors:
+                if actor in self.destroying or actor.body.IsStatic():
+                    continue
+                self.push_body(actor.body, cluster)
 
-    def persist_contact(self, point):
-        pass
+    def push_body(self, body, explosions):
+        center = body.GetWorldCenter()
+        impulse_x = impulse_y = 0
+        for x, y, radius, impulse, falloff in explosions:
+            distance = get_body_distance(body, (x, y))
+            dx, dy = center.x - x, center.y - y
+            length = hypot(dx, dy)
+            if distance < radius and length:
+                scale = impulse * falloff(distance / radius) / length
+                impulse_x += scale * dx
+                impulse_y += scale * dy
+        if impulse_x or impulse_y:
+            body.WakeUp()
+            body.ApplyImpulse(b2Vec2(impulse_x, impulse_y), center)
 
-    def remove_contact(self, point):
-        pass
+    def add_contact_mask(self, category, contact_mask):
+        self.contact_masks[category] = (self.contact_masks.get(category, 0) |
+                                        contact_mask)
 
-    def contact_result(self, point):
-        pass
+    def add_contact(self, point):
+        shape_1 = point.shape1
+        shape_2 = point.shape2
+        category_1 = shape_1.GetFilterData().categoryBits
+        category_2 = shape_2.GetFilterData().categoryBits
+        masks = self.contact_masks
+        if not (masks.get(category_1, 0) & category_2 or
+                masks.get(category_2, 0) & category_1):
+            return
+        actor_1 = shape_1.GetBody().GetUserData()
+        actor_2 = shape_2.GetBody().GetUserData()
+        if actor_1 and actor_2:
+            if actor_1.contact_mask & category_2:
+                self.contacts[actor_1, actor_2] = True
+            if actor_2.contact_mask & category_1:
+                self.contacts[actor_2, actor_1] = True
 
     def boundary_violation(self, body):
         actor = body.userData
         self.destroying.add(actor)
 
     def draw_circle(self):
+        if self.circle_display_list is None:
+            self.circle_display_list = glGenLists(1)
+            glNewList(self.circle_display_list, GL_COMPILE)
+            self._draw_circle()
+            glEndList()
         glCallList(self.circle_display_list)
 
     def _draw_circle(self):
@@ -152,30 +462,116 @@ class Level(object):
             glVertex2d(cos(angle), sin(angle))
         glEnd()
 
-    def parse_element_data(self, element):
-        data = {}
-        for name in ('style', 'inkscape:label'):
-            value = element.getAttribute(name)
-            data.update(parse_style(value))
-        return data
-    
+def get_body_distance(body, point):
+    """
+    Return the distance from a point to the nearest shape of a body, or 0
+    if the point is inside a shape.
+    """
+    x, y = point
+    p = body.position
+    c, s = cos(body.angle), sin(body.angle)
+    distance = None
+    for shape in body.shapeList:
+        polygon = shape.asPolygon()
+        circle = shape.asCircle()
+        if polygon:
+            vertices = [(p.x + c * vx - s * vy, p.y + s * vx + c * vy)
+                        for vx, vy in polygon.vertices]
+            shape_distance = polygon_distance(vertices, point)
+        elif circle:
+            lp = circle.localPosition
+            shape_distance = max(hypot(p.x + c * lp.x - s * lp.y - x,
+                                       p.y + s * lp.x + c * lp.y - y) -
+                                 circle.radius, 0)
+        else:
+            continue
+        if distance is None or shape_distance < distance:
+            distance = shape_distance
+    return distance if distance is not None else hypot(p.x - x, p.y - y)
+
+def is_far(body, x, y, distance):
+    p = body.position
+    return abs(p.x - x) > distance or abs(p.y - y) > distance
+
+def freeze_body(body):
+    """
+    Put a body to sleep and return its velocity for `thaw_body`.
+    """
+    velocity = body.linearVelocity
+    saved = (velocity.x, velocity.y), body.angularVelocity
+    body.PutToSleep()
+    return saved
+
+def thaw_body(body, velocity):
+    """
+    Give an awake body back the velocity that it had when it was frozen.
+    Putting a body to sleep zeroes its velocity, so whatever it has now
+    came from whatever woke it up, and the two are added.
+
+    >>> class Vector(object):
+    ...     def __init__(self, x, y):
+    ...         self.x, self.y = x, y
+    >>> class Body(object):
+    ...     def __init__(self):
+    ...         self.linearVelocity = Vector(3, 4)
+    ...         self.angularVelocity = 0.5
+    ...     def PutToSleep(self):
+    ...         self.linearVelocity = Vector(0, 0)
+    ...         self.angularVelocity = 0
+    ...     def ApplyImpulse(self, x, y):
+    ...         self.linearVelocity.x += x
+    ...         self.linearVelocity.y += y
+    >>> body = Body()
+    >>> velocity = freeze_body(body)
+    >>> body.linearVelocity.x, body.angularVelocity
+    (0, 0)
+    >>> thaw_body(body, velocity)
+    >>> body.linearVelocity, body.angularVelocity
+    ((3, 4), 0.5)
+    >>> body = Body()
+    >>> velocity = freeze_body(body)
+    >>> body.ApplyImpulse(1, -1)
+    >>> thaw_body(body, velocity)
+    >>> body.linearVelocity, body.angularVelocity
+    ((4, 3), 0.5)
+    """
+    (x, y), angular_velocity = velocity
+    current = body.linearVelocity
+    body.linearVelocity = x + current.x, y + current.y
+    body.angularVelocity += angular_velocity
+
+def get_jointed_bodies(body):
+    """
+    Return a body and the dynamic bodies connected to it through joints,
+    directly or through other dynamic bodies.
+    """
+    # Body proxies are created on every access, so visited bodies are
+    # tracked by their actors.
+    actors = set([body.userData])
+    bodies = [body]
+    stack = [body]
+    while stack:
+        edge = stack.pop().GetJointList()
+        while edge:
+            other = edge.other
+            if not other.IsStatic() and other.userData not in actors:
+                actors.add(other.userData)
+                bodies.append(other)
+                stack.append(other)
+            edge = edge.next
+    return bodies
+
 class CannonballContactListener(b2ContactListener):
     def __init__(self, level):
         super(CannonballContactListener, self).__init__() 
         self.level = level
 
+    # Only new contacts are handled. The other events are left to the base
+    # class, which ignores them. Every new contact point is still passed
+    # here, and filtered in Level.add_contact.
     def Add(self, point):
         self.level.add_contact(point)
 
-    def Persist(self, point):
-        self.level.persist_contact(point)
-
-    def Remove(self, point):
-        self.level.remove_contact(point)
-
-    def Result(self, point):
-        self.level.contact_result(point)
-
 class CannonballBoundaryListener(b2BoundaryListener):
     def __init__(self, level):
         super(CannonballBoundaryListener, self).__init__()
@@ -183,48 +579,3 @@ class CannonballBoundaryListener(b2BoundaryListener):
 
     def Violation(self, body):
         self.level.boundary_violation(body)
-
-def get_scale(document):
-    text_elements = document.getElementsByTagName('text')
-    scale_elements = [e for e in text_elements
-                      if e.getAttribute('id') == 'scale']
-    if scale_elements:
-        scale_text = get_text(scale_elements[0]).strip()
-        scale_text = scale_text.lstrip('page-width').rstrip('m').strip()
-        scale_text = scale_text.lstrip(':').strip()
-        scale_width = float(scale_text) if scale_text else 1
-        svg_element = document.getElementsByTagName('svg')[0]
-        document_width = float(svg_element.getAttribute('width'))
-        return scale_width / document_width
-    return 1
-
-def get_text(element):
-    for node in element.childNodes:
-        if node.nodeType == node.TEXT_NODE:
-            return node.nodeValue
-        elif node.nodeType == node.ELEMENT_NODE:
-            return get_text(node)
-    return ''
-
-def load_layers(level, root, transform):
-    for layer in root.childNodes:
-        if (layer.nodeName == 'g' and
-            layer.getAttribute('inkscape:groupmode') == 'layer'):
-            for node in layer.childNodes:
-                if node.nodeName in ('g', 'path'):
-                    load_body(level, node, transform)
-
-def load_body(level, node, transform):
-    data = level.parse_element_data(node)
-    actor_name = data.get('actor')
-    if actor_name:
-        module_name, class_name = actor_name.rsplit('.', 1)
-        __import__(module_name)
-        module = sys.modules[module_name]
-        cls = getattr(module, class_name)
-        actor = cls(level)
-    else:
-        actor = Actor(level)
-    actor.id = node.getAttribute('id')
-    level.actors[actor.id] = actor
-    actor.load(node, transform)
@@ -0,0 +1,398 @@
+# Future imports.
+from __future__ import division
+
+# Project imports.
+from cannonball.LevelData import *
+from cannonball.svg import *
+
+# Standard library imports.
+import hashlib
+import os
+import struct
+import sys
+from xml.etree.cElementTree import iterparse
+
+class LevelCompiler(object):
+    """
+    Compile a level SVG into level data: linearized, triangulated and merged
+    shapes with their materials, render meshes, joint positions and actor
+    class names.
+
+    The SVG is streamed. Each body is compiled as soon as its element ends
+    and is then dropped from the tree, so memory use does not grow with the
+    size of the file. Patterns and images are indexed by id as they stream
+    past, and texture references are resolved at the end. The level
+    settings text sets the scale of the level and may come after the
+    bodies, so bodies that end before it are kept and compiled once it has
+    been read, or at the end of the file if there is none.
+
+    Curves are flattened to within a world-space tolerance, separately for
+    collision and render geometry. The level settings and the style or
+    label of each element can set `tolerance` for both, or
+    `collision-tolerance` and `render-tolerance` separately.
+    """
+
+    collision_tolerance = 0.05
+    render_tolerance = 0.02
+
+    def __init__(self):
+        self.data = None
+        self.tolerances = self.collision_tolerance, self.render_tolerance
+        self.pattern_links = {}
+        self.pattern_images = {}
+        self.images = {}
+        self.pending_textures = []
+
+    def compile(self, path):
+        self.data = LevelData()
+        self.pattern_links.clear()
+        self.pattern_images.clear()
+        self.images.clear()
+        del self.pending_textures[:]
+        width = height = 0
+        transform = None
+        deferred = []
+        for event, element, parents in stream_elements(path):
+            name = get_name(element)
+            if event == 'start':
+                if not parents:
+                    width = float(get_attribute(element, 'width'))
+                    height = float(get_attribute(element, 'height'))
+                continue
+            parent = parents[-1] if parents else None
+            if name == 'sodipodi:namedview':
+                page_color = Color(get_attribute(element, 'pagecolor') or
+                                   '#000000')
+                self.data.background_color = tuple(c / 255
+                                                   for c in page_color)
+            elif name == 'pattern':
+                pattern_id = get_attribute(element, 'id')
+                self.pattern_links[pattern_id] = get_attribute(element,
+                                                               'xlink:href')
+            elif name == 'image':
+                href = get_attribute(element, 'xlink:href')
+                self.images[get_attribute(element, 'id')] = href
+                if parent is not None and get_name(parent) == 'pattern':
+                    self.pattern_images.setdefault(get_attribute(parent, 'id'),
+                                                   href)
+            elif (name == 'text' and get_attribute(element, 'id') == 'scale'
+                  and transform is None):
+                settings = parse_level_settings(''.join(element.itertext()))
+                transform = self.apply_settings(settings, width, height)
+                for body_element in deferred:
+                    self.compile_body(body_element, transform)
+                del deferred[:]
+            elif (name in ('g', 'path') and len(parents) == 2 and
+                  is_layer(parent)):
+                if transform is None:
+                    deferred.append(element)
+                else:
+                    self.compile_body(element, transform)
+        if transform is None:
+            transform = self.apply_settings({}, width, height)
+            for body_element in deferred:
+                self.compile_body(body_element, transform)
+        for material, pattern_id in self.pending_textures:
+            material.texture = self.get_image_path(pattern_id)
+        del self.pending_textures[:]
+        data = self.data
+        self.data = None
+        return data
+
+    def apply_settings(self, settings, width, height):
+        """
+        Apply the level settings, for example "page-width: 100m; tolerance:
+        0.05", and return the transform from document to world space.
+        """
+        scale = 1
+        if settings.get('page-width') and width:
+            scale = parse_length(settings['page-width']) / width
+        self.tolerances = get_tolerances(settings, self.collision_tolerance,
+                                         self.render_tolerance)
+        self.data.width = width * scale
+        self.data.height = height * scale
+        return (create_translate_transform(0, height * scale) *
+                create_scale_transform(scale) *
+                create_scale_transform(1, -1))
+
+    def compile_body(self, element, transform):
+        data = parse_element_data(element)
+        cls = get_actor_class(data.get('actor'))
+        cls.compile(self, element, transform)
+
+    def compile_shapes(self, body, element, transform, tolerances=None):
+        transform = transform * Transform(get_attribute(element, 'transform'))
+        tolerances = tolerances or self.tolerances
+        name = get_name(element)
+        if name == 'g':
+            data = parse_element_data(element)
+            tolerances = get_tolerances(data, *tolerances)
+            for child in element:
+                if get_name(child) in ('g', 'path'):
+                    self.compile_shapes(body, child, transform, tolerances)
+        elif name == 'path':
+            self.compile_shape(body, element, transform, tolerances)
+
+    def compile_shape(self, body, element, transform, tolerances):
+        data = parse_element_data(element)
+        color = Color('#ffffff')
+        pattern_id = None
+        fill = data.get('fill')
+        if fill.startswith('#'):
+            color = Color(fill)
+        elif fill.startswith('url(#') and fill.endswith(')'):
+            pattern_id = fill.lstrip('url(#').rstrip(')')
+        color = tuple(c / 255 for c in color)
+        density = float(data.get('density', '0'))
+        sensor = data.get('sensor') == 'true'
+        collision_tolerance, render_tolerance = get_tolerances(data,
+                                                               *tolerances)
+
+        # Tolerances are in world units, but curves are flattened before
+        # the transform is applied.
+        max_scale = transform.max_scale or 1
+        path = Path(get_attribute(element, 'd'))
+        for subpath in path.subpaths:
+            polygon = subpath.linearize(collision_tolerance / max_scale)
+            polygon = (transform * polygon).normalize()
+            vertices = map(tuple, polygon.array.tolist())
+            vertex_normals = map(tuple, polygon.normals().tolist())
+            triangles = polygon.triangle_indices()
+            pieces = merge_convex(polygon.array, triangles,
+                                  max_polygon_vertices)
+            self.data.triangle_count += len(triangles)
+            self.data.shape_count += len(pieces)
+            for piece in pieces:
+                shape = ShapeData([vertices[i] for i in piece],
+                                  [vertex_normals[i] for i in piece],
+                                  color, None, density, sensor)
+                if pattern_id:
+                    self.pending_textures.append((shape, pattern_id))
+                body.shapes.append(shape)
+
+            if render_tolerance != collision_tolerance:
+                polygon = subpath.linearize(render_tolerance / max_scale)
+                polygon = (transform * polygon).normalize()
+                vertices = map(tuple, polygon.array.tolist())
+                vertex_normals = map(tuple, polygon.normals().tolist())
+                triangles = polygon.triangle_indices()
+            self.data.vertex_count += len(vertices)
+            mesh = MeshData(vertices, vertex_normals, triangles, color)
+            if pattern_id:
+                self.pending_textures.append((mesh, pattern_id))
+            body.meshes.append(mesh)
+
+    def get_image_path(self, pattern_id):
+        visited = set()
+        while pattern_id not in visited:
+            visited.add(pattern_id)
+            href = self.pattern_links.get(pattern_id)
+            if href:
+                pattern_id = href.lstrip('#')
+            elif pattern_id in self.pattern_images:
+                return self.pattern_images[pattern_id]
+            else:
+                return self.images.get(pattern_id)
+        return None
+
+# Box2D's b2_maxPolygonVertices.
+max_polygon_vertices = 8
+
+namespaces = {
+    'svg': 'http://www.w3.org/2000/svg',
+    'xlink': 'http://www.w3.org/1999/xlink',
+    'sodipodi': 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd',
+    'inkscape': 'http://www.inkscape.org/namespaces/inkscape',
+}
+
+prefixes = dict((uri, prefix) for prefix, uri in namespaces.iteritems())
+
+def qualify(name):
+    """
+    >>> qualify('inkscape:label')
+    '{http://www.inkscape.org/namespaces/inkscape}label'
+    >>> qualify('id')
+    'id'
+    """
+    if ':' in name:
+        prefix, name = name.split(':', 1)
+        return '{%s}%s' % (namespaces[prefix], name)
+    return name
+
+def get_name(element):
+    """
+    Return the tag name of an element as Inkscape writes it, without a
+    prefix for SVG elements.
+    """
+    tag = element.tag
+    if tag.startswith('{'):
+        uri, name = tag[1:].split('}', 1)
+        prefix = prefixes.get(uri)
+        if prefix and prefix != 'svg':
+            return '%s:%s' % (prefix, name)
+        return name
+    return tag
+
+def get_attribute(element, name):
+    return element.get(qualify(name), '')
+
+def stream_elements(path):
+    """
+    Yield start and end events for the elements of an SVG file together
+    with the list of ancestors of each element. Top-level subtrees and the
+    children of layers are dropped from the tree after their end event has
+    been handled.
+    """
+    parents = []
+    for event, element in iterparse(path, ('start', 'end')):
+        if event == 'start':
+            yield event, element, parents
+            parents.append(element)
+        else:
+            parents.pop()
+            yield event, element, parents
+            if len(parents) == 1 or (len(parents) == 2 and
+                                     is_layer(parents[-1])):
+                parents[-1].remove(element)
+
+def is_layer(element):
+    return (get_name(element) == 'g' and
+            get_attribute(element, 'inkscape:groupmode') == 'layer')
+
+def get_actor_class(actor_name):
+    if not actor_name:
+        from cannonball.Actor import Actor
+        return Actor
+    if '.' not in actor_name:
+        actor_name = 'cannonball.actors.%s.%s' % (actor_name, actor_name)
+    module_name, class_name = actor_name.rsplit('.', 1)
+    __import__(module_name)
+    module = sys.modules[module_name]
+    return getattr(module, class_name)
+
+def get_actor_name(cls):
+    from cannonball.Actor import Actor
+    if cls is Actor:
+        return None
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+def parse_element_data(element):
+    data = {}
+    for name in ('style', 'inkscape:label'):
+        value = get_attribute(element, name)
+        data.update(parse_style(value))
+    return data
+
+def parse_level_settings(text):
+    """
+    >>> sorted(parse_level_settings('page-width: 100m; tolerance: 0.1')
+    ...        .items())
+    [('page-width', '100m'), ('tolerance', '0.1')]
+    >>> parse_level_settings('100m')
+    {'page-width': '100m'}
+    """
+    text = text.strip()
+    if ':' not in text:
+        return {'page-width': text} if text else {}
+    return parse_style(text)
+
+def parse_length(text):
+    """
+    >>> parse_length('100m')
+    100.0
+    """
+    text = text.strip().rstrip('m').strip()
+    return float(text) if text else 1
+
+def get_tolerances(data, collision_tolerance, render_tolerance):
+    if data.get('tolerance'):
+        collision_tolerance = render_tolerance = float(data['tolerance'])
+    collision_tolerance = float(data.get('collision-tolerance',
+                                         collision_tolerance))
+    render_tolerance = float(data.get('render-tolerance', render_tolerance))
+    return collision_tolerance, render_tolerance
+
+def get_cache_path(path):
+    return os.path.splitext(path)[0] + '.cbl'
+
+def get_digest(path):
+    """
+    Return a digest of a level SVG and of the compiler defaults that its
+    level data depends on, so that changing a default invalidates caches.
+    """
+    f = open(path, 'rb')
+    try:
+        digest = hashlib.sha1(f.read())
+    finally:
+        f.close()
+    digest.update(repr((LevelCompiler.collision_tolerance,
+                        LevelCompiler.render_tolerance,
+                        max_polygon_vertices)))
+    return digest.digest()
+
+def compile_level(path, cache_path=None):
+    """
+    Compile a level SVG and write the result to its cache file.
+    """
+    digest = get_digest(path)
+    data = LevelCompiler().compile(path)
+    try:
+        write_level_cache(cache_path or get_cache_path(path), data, digest)
+    except (IOError, OSError):
+        # The cache is only an optimization.
+        pass
+    return data
+
+def write_level_cache(cache_path, data, digest):
+    """
+    Write level data to a cache file, replacing it only once it has been
+    written in full.
+    """
+    temp_path = cache_path + '.tmp'
+    f = open(temp_path, 'wb')
+    try:
+        write_level_data(f, data, digest)
+    finally:
+        f.close()
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    os.rename(temp_path, cache_path)
+
+def is_cache_current(path, cache_path=None):
+    """
+    Return True if the cache file of a level SVG exists and was written
+    from the current contents of the SVG, with the current format and
+    compiler defaults.
+    """
+    cache_path = cache_path or get_cache_path(path)
+    if not os.path.exists(cache_path):
+        return False
+    f = open(cache_path, 'rb')
+    try:
+        header = f.read(header_size)
+    finally:
+        f.close()
+    if len(header) != header_size:
+        return False
+    return struct.unpack(header_format, header) == (magic, format_version,
+                                                    get_digest(path))
+
+def load_level_data(path):
+    """
+    Load level data from the cache file next to the level SVG, compiling
+    the level first if the cache is missing or out of date.
+    """
+    cache_path = get_cache_path(path)
+    if os.path.exists(cache_path):
+        digest = get_digest(path)
+        f = open(cache_path, 'rb')
+        try:
+            try:
+                data = read_level_data(f, digest)
+            except (EOFError, ValueError, TypeError):
+                data = None
+        finally:
+            f.close()
+        if data is not None:
+            return data
+    return compile_level(path, cache_path)
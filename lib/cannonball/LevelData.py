@@ -0,0 +1,158 @@
+from __future__ import division
+
+import numpy
+
+import marshal
+import struct
+
+class LevelData(object):
+    """
+    Fully processed level geometry, ready to be turned into a Box2D world.
+    """
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.background_color = 0, 0, 0
+        self.bodies = []
+        self.joints = []
+        self.triangle_count = 0
+        self.shape_count = 0
+        self.vertex_count = 0
+
+class BodyData(object):
+    __slots__ = 'id', 'actor_name', 'shapes', 'meshes'
+
+    def __init__(self, id, actor_name=None):
+        self.id = id
+        self.actor_name = actor_name
+        self.shapes = []
+        self.meshes = []
+
+class ShapeData(object):
+    __slots__ = 'vertices', 'normals', 'color', 'texture', 'density', 'sensor'
+
+    def __init__(self, vertices, normals, color=(1, 1, 1), texture=None,
+                 density=0, sensor=False):
+        self.vertices = vertices
+        self.normals = normals
+        self.color = color
+        self.texture = texture
+        self.density = density
+        self.sensor = sensor
+
+class MeshData(object):
+    """
+    Render geometry: a triangulated outline with a normal per vertex.
+    """
+
+    __slots__ = 'vertices', 'normals', 'triangles', 'color', 'texture'
+
+    def __init__(self, vertices, normals, triangles, color=(1, 1, 1),
+                 texture=None):
+        self.vertices = vertices
+        self.normals = normals
+        self.triangles = triangles
+        self.color = color
+        self.texture = texture
+
+magic = 'CBLV'
+format_version = 3
+header_format = '<4sI20s'
+header_size = struct.calcsize(header_format)
+
+def write_level_data(f, data, digest):
+    f.write(struct.pack(header_format, magic, format_version, digest))
+    bodies = []
+    for body in data.bodies:
+        shape_records = []
+        vertices = []
+        normals = []
+        for shape in body.shapes:
+            shape_records.append((len(shape.vertices), tuple(shape.color),
+                                  shape.texture, shape.density,
+                                  shape.sensor))
+            vertices.extend(shape.vertices)
+            normals.extend(shape.normals)
+        mesh_records = []
+        mesh_vertices = []
+        mesh_normals = []
+        triangles = []
+        for mesh in body.meshes:
+            mesh_records.append((len(mesh.vertices), len(mesh.triangles),
+                                 tuple(mesh.color), mesh.texture))
+            mesh_vertices.extend(mesh.vertices)
+            mesh_normals.extend(mesh.normals)
+            triangles.extend(mesh.triangles)
+        bodies.append((body.id, body.actor_name, tuple(shape_records),
+                       pack(vertices, numpy.float32, 2),
+                       pack(normals, numpy.float32, 3),
+                       tuple(mesh_records),
+                       pack(mesh_vertices, numpy.float32, 2),
+                       pack(mesh_normals, numpy.float32, 3),
+                       pack(triangles, numpy.int32, 3)))
+    payload = (data.width, data.height, tuple(data.background_color),
+               data.triangle_count, data.shape_count, data.vertex_count,
+               tuple(tuple(j) for j in data.joints), tuple(bodies))
+    f.write(marshal.dumps(payload))
+
+def read_level_data(f, digest=None):
+    """
+    Read level data written by `write_level_data`. Return None if the file
+    has another format version or, when given, another content digest.
+    """
+    header = f.read(header_size)
+    if len(header) != header_size:
+        return None
+    file_magic, file_version, file_digest = struct.unpack(header_format,
+                                                          header)
+    if file_magic != magic or file_version != format_version:
+        return None
+    if digest is not None and file_digest != digest:
+        return None
+    (width, height, background_color, triangle_count, shape_count,
+     vertex_count, joints, bodies) = marshal.loads(f.read())
+    data = LevelData()
+    data.width = width
+    data.height = height
+    data.background_color = background_color
+    data.triangle_count = triangle_count
+    data.shape_count = shape_count
+    data.vertex_count = vertex_count
+    data.joints = list(joints)
+    for (id, actor_name, shape_records, vertices, normals, mesh_records,
+         mesh_vertices, mesh_normals, triangles) in bodies:
+        body = BodyData(id, actor_name)
+        vertices = unpack(vertices, numpy.float32, 2)
+        normals = unpack(normals, numpy.float32, 3)
+        start = 0
+        for count, color, texture, density, sensor in shape_records:
+            end = start + count
+            body.shapes.append(ShapeData(vertices[start:end],
+                                         normals[start:end], color, texture,
+                                         density, sensor))
+            start = end
+        mesh_vertices = unpack(mesh_vertices, numpy.float32, 2)
+        mesh_normals = unpack(mesh_normals, numpy.float32, 3)
+        triangles = unpack(triangles, numpy.int32, 3)
+        start = 0
+        triangle_start = 0
+        for count, triangle_count, color, texture in mesh_records:
+            end = start + count
+            triangle_end = triangle_start + triangle_count
+            body.meshes.append(MeshData(mesh_vertices[start:end],
+                                        mesh_normals[start:end],
+                                        triangles[triangle_start:
+                                                  triangle_end],
+                                        color, texture))
+            start = end
+            triangle_start = triangle_end
+        data.bodies.append(body)
+    return data
+
+def pack(rows, dtype, width):
+    return numpy.array(rows, dtype=dtype).reshape(-1, width).tostring()
+
+def unpack(s, dtype, width):
+    rows = numpy.fromstring(s, dtype=dtype).reshape(-1, width).tolist()
+    return map(tuple, rows)
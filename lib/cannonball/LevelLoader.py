@@ -0,0 +1,106 @@
+from __future__ import division
+
+from cannonball.Level import *
+from cannonball.ParticleSystem import ParticleSystem
+from cannonball.TextureManager import texture_manager
+
+import os
+import sys
+import threading
+
+class LevelLoader(object):
+    """
+    Load a level on a worker thread.
+
+    The worker reads or compiles the level data, creates the world and its
+    bodies, and decodes the images that the level uses. None of this makes
+    GL calls, so the window keeps drawing while the worker runs. When
+    `done` is set, `finish` uploads the decoded images as textures on the
+    calling thread, which must own the GL context, and returns the level.
+
+    Parsing and body creation are Python code that holds the global
+    interpreter lock, so frames are slower while a level loads, but they do
+    not stop.
+    """
+
+    # Fractions of the progress bar for each stage of loading.
+    data_fraction = 0.4
+    bodies_fraction = 0.4
+    images_fraction = 0.2
+
+    def __init__(self, path, seed=None):
+        self.path = path
+        self.seed = seed
+        self.status = 'Loading'
+        self.progress = 0
+        self.level = None
+        self.images = []
+        self.exc_info = None
+        self.done = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.status = 'Loading level data'
+            data = load_level_data(self.path)
+            self.progress = self.data_fraction
+            self.status = 'Creating bodies'
+            self.level = Level(self.path, data, self.seed,
+                               self.update_bodies_progress)
+            self.images = get_images(self.level, data)
+            self.status = 'Decoding images'
+            for i, (path, atlas) in enumerate(self.images):
+                try:
+                    texture_manager.load_image(path)
+                except:
+                    # Missing images fail again, and are handled, when
+                    # they are drawn.
+                    pass
+                self.progress = (self.data_fraction + self.bodies_fraction +
+                                 self.images_fraction * (i + 1) /
+                                 len(self.images))
+            self.status = 'Uploading textures'
+            self.progress = 1
+        except:
+            self.exc_info = sys.exc_info()
+        self.done = True
+
+    def update_bodies_progress(self, count, total):
+        self.progress = (self.data_fraction +
+                         self.bodies_fraction * count / total)
+
+    def finish(self):
+        """
+        Upload the decoded images and return the loaded level. Exceptions
+        raised on the worker thread are raised again here.
+        """
+        self.thread.join()
+        if self.exc_info:
+            exc_type, exc_value, traceback = self.exc_info
+            raise exc_type, exc_value, traceback
+        for path, atlas in self.images:
+            try:
+                self.level.get_texture(path, atlas)
+            except:
+                pass
+        self.level.get_background()
+        return self.level
+
+def get_images(level, data):
+    """
+    Return the absolute path of each image that a level uses, and whether
+    it goes to the texture atlas, in a fixed order.
+    """
+    level_dir = os.path.dirname(level.path)
+    paths = set([level.get_background_path()])
+    for body_data in data.bodies:
+        for item in body_data.shapes + body_data.meshes:
+            if item.texture:
+                paths.add(os.path.join(level_dir, item.texture))
+    images = set((os.path.abspath(path), False) for path in paths)
+    images.add((os.path.abspath(os.path.join(level_dir,
+                                             ParticleSystem.texture_path)),
+                True))
+    return sorted(images)
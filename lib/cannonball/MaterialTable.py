@@ -0,0 +1,40 @@
+class Material(object):
+    __slots__ = 'color', 'texture'
+
+    def __init__(self, color, texture=None):
+        self.color = color
+        self.texture = texture
+
+class MaterialTable(object):
+    """
+    Materials interned by color and texture, so that shapes can refer to
+    shared records by index.
+
+    >>> table = MaterialTable()
+    >>> table.intern((1, 0, 0)), table.intern((0, 1, 0), 'metal.jpg')
+    (0, 1)
+    >>> table.intern([1.0, 0.0, 0.0])
+    0
+    >>> table[1].texture
+    'metal.jpg'
+    """
+
+    def __init__(self):
+        self.materials = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.materials)
+
+    def __getitem__(self, id):
+        return self.materials[id]
+
+    def intern(self, color, texture=None):
+        key = tuple(color), texture
+        id = self.ids.get(key)
+        if id is None:
+            id = self.ids[key] = len(self.materials)
+            self.materials.append(Material(*key))
+        return id
+
+material_table = MaterialTable()
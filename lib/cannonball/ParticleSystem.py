@@ -0,0 +1,101 @@
+from __future__ import division
+
+import numpy
+import pyglet
+from pyglet.gl import *
+
+from math import *
+
+class ParticleSystem(object):
+    """
+    Smoke particles in a fixed-capacity pool of arrays.
+
+    Live particles are kept packed at the front of the arrays. They are
+    advanced in one vectorized step, with gravity and linear damping
+    applied the way Box2D applies them, and drawn as a single quad array.
+    Particles do not collide.
+    """
+
+    capacity = 1024
+    gravity = 0, -10
+
+    # A puff used to be a Box2D circle with radius 0.2 and density 1.
+    particle_mass = pi * 0.2 ** 2
+
+    min_radius = 1
+    max_radius = 6
+    texture_path = '../textures/smoke.png'
+
+    def __init__(self, level, capacity=None):
+        self.level = level
+        self.capacity = capacity or self.capacity
+        self.count = 0
+        self.positions = numpy.zeros((self.capacity, 2))
+        self.velocities = numpy.zeros((self.capacity, 2))
+        self.damping = numpy.zeros(self.capacity)
+        self.creation_times = numpy.zeros(self.capacity)
+        self.lifetimes = numpy.ones(self.capacity)
+
+    def emit(self, position, linear_velocity, impulse=(0, 0), damping=2,
+             lifetime=None):
+        """
+        Emit a particle, unless the pool is full. The impulse is applied as
+        if to a puff of `particle_mass`.
+        """
+        if self.count == self.capacity:
+            return
+        if lifetime is None:
+            lifetime = 0.5 + 0.5 * self.level.random.random()
+        i = self.count
+        self.count += 1
+        self.positions[i] = tuple(position)
+        self.velocities[i] = tuple(linear_velocity)
+        self.velocities[i] += numpy.array(tuple(impulse)) / self.particle_mass
+        self.damping[i] = damping
+        self.creation_times[i] = self.level.time
+        self.lifetimes[i] = lifetime
+
+    def step(self, dt):
+        n = self.count
+        if not n:
+            return
+        alive = (self.level.time - self.creation_times[:n] <
+                 self.lifetimes[:n])
+        if not alive.all():
+            n = self.count = int(alive.sum())
+            for array in (self.positions, self.velocities, self.damping,
+                          self.creation_times, self.lifetimes):
+                array[:n] = array[:len(alive)][alive]
+        velocities = self.velocities[:n]
+        velocities += numpy.array(self.gravity) * dt
+        velocities *= numpy.clip(1 - dt * self.damping[:n], 0,
+                                 1)[:, numpy.newaxis]
+        self.positions[:n] += velocities * dt
+
+    def draw(self):
+        n = self.count
+        if not n:
+            return
+        progress = ((self.level.time - self.creation_times[:n]) /
+                    self.lifetimes[:n]).clip(0, 1)
+        radii = (self.min_radius +
+                 (self.max_radius - self.min_radius) * progress)
+        corners = numpy.array([(-1, -1), (1, -1), (1, 1), (-1, 1)])
+        vertices = (self.positions[:n, numpy.newaxis, :] +
+                    radii[:, numpy.newaxis, numpy.newaxis] * corners)
+        colors = numpy.ones((n, 4, 4))
+        colors[:, :, 3] = (1 - progress)[:, numpy.newaxis]
+
+        # The texture may be a region of an atlas. Its corners are in the
+        # same order as the quad corners.
+        texture = self.level.get_texture(self.texture_path, atlas=True)
+        tex_coords = numpy.array(texture.tex_coords).reshape(4, 3)[:, :2]
+        tex_coords = numpy.tile(tex_coords, (n, 1))
+        glEnable(texture.target)
+        glBindTexture(texture.target, texture.id)
+        glNormal3d(0, 0, 1)
+        pyglet.graphics.draw(4 * n, GL_QUADS,
+                             ('v2f', vertices.ravel().tolist()),
+                             ('t2f', tex_coords.ravel().tolist()),
+                             ('c4f', colors.ravel().tolist()))
+        glDisable(texture.target)
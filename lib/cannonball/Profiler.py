@@ -0,0 +1,98 @@
+from __future__ import division
+
+import numpy
+
+import json
+from timeit import default_timer
+
+class Profiler(object):
+    """
+    Per-frame phase timings and counters in fixed-size ring buffers.
+
+    Time between `start` and `stop` is added to the current frame, so phases
+    that run several times per frame, like physics steps, are summed.
+    Counters keep the last value set, also in frames that do not set them.
+    """
+
+    def __init__(self, size=600):
+        self.size = size
+        self.frame = 0
+        self.timings = {}
+        self.counts = {}
+        self.starts = {}
+        self.frame_start = default_timer()
+
+    @property
+    def index(self):
+        return self.frame % self.size
+
+    def start(self, name):
+        self.starts[name] = default_timer()
+
+    def stop(self, name):
+        self.add(name, default_timer() - self.starts[name])
+
+    def add(self, name, elapsed):
+        if name not in self.timings:
+            self.timings[name] = numpy.zeros(self.size)
+        self.timings[name][self.index] += elapsed
+
+    def count(self, name, value):
+        if name not in self.counts:
+            self.counts[name] = numpy.zeros(self.size, dtype=numpy.int64)
+        self.counts[name][self.index] = value
+
+    def next_frame(self):
+        now = default_timer()
+        self.add('frame', now - self.frame_start)
+        self.frame_start = now
+        previous = self.index
+        self.frame += 1
+        for array in self.timings.itervalues():
+            array[self.index] = 0
+        for array in self.counts.itervalues():
+            array[self.index] = array[previous]
+
+    def get_frames(self):
+        """
+        Return the indices of the finished frames in the ring buffers, from
+        oldest to newest.
+        """
+        first = max(0, self.frame - self.size + 1)
+        return [i % self.size for i in xrange(first, self.frame)]
+
+    def get_percentiles(self, name, percentiles=(50, 95, 99)):
+        frames = self.get_frames()
+        if name not in self.timings or not frames:
+            return [0] * len(percentiles)
+        return numpy.percentile(self.timings[name][frames], percentiles)
+
+    def get_summary(self):
+        """
+        Return text lines with rolling percentiles in milliseconds for each
+        phase, and the latest value of each counter.
+        """
+        lines = ['%-12s %7s %7s %7s' % ('ms', 'p50', 'p95', 'p99')]
+        for name in sorted(self.timings):
+            lines.append('%-12s %7.2f %7.2f %7.2f' % (
+                (name,) + tuple(1000 * t for t in self.get_percentiles(name))))
+        frames = self.get_frames()
+        if frames:
+            for name in sorted(self.counts):
+                lines.append('%-12s %7d' % (name,
+                                            self.counts[name][frames[-1]]))
+        return lines
+
+    def dump(self, f):
+        """
+        Write the finished frames in the ring buffers as JSON lines, with
+        times in milliseconds.
+        """
+        first = max(0, self.frame - self.size + 1)
+        for frame, i in zip(xrange(first, self.frame), self.get_frames()):
+            record = {'frame': frame}
+            record['times'] = dict((name, 1000 * array[i]) for name, array
+                                   in self.timings.iteritems())
+            record['counts'] = dict((name, int(array[i])) for name, array
+                                    in self.counts.iteritems())
+            f.write(json.dumps(record, sort_keys=True) + '\n')
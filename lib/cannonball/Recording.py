@@ -0,0 +1,101 @@
+from __future__ import division
+
+import hashlib
+import os
+import struct
+import zlib
+
+class Recording(object):
+    """
+    The cannonball input flags of every physics step of a run, together
+    with everything else needed to reproduce the run: the level, the seed
+    of the level's random number generator and the time step.
+
+    Saved recordings store the level path relative to the recording file,
+    so that they replay from any working directory.
+    """
+
+    def __init__(self, level_path, seed, dt=1 / 60):
+        self.level_path = level_path
+        self.seed = seed
+        self.dt = dt
+        self.inputs = []
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def record(self, cannonball):
+        self.inputs.append(cannonball.get_input_flags())
+
+    def replay(self, cannonball, tick):
+        """
+        Set the input flags of the cannonball for the given step. Return
+        False if the recording has ended.
+        """
+        if tick >= len(self.inputs):
+            return False
+        cannonball.set_input_flags(self.inputs[tick])
+        return True
+
+magic = 'CBRP'
+format_version = 2
+header_format = '<4sIIdI'
+header_size = struct.calcsize(header_format)
+
+def write_recording(f, recording, level_path=None):
+    if level_path is None:
+        level_path = recording.level_path
+    f.write(struct.pack(header_format, magic, format_version, recording.seed,
+                        recording.dt, len(level_path)))
+    f.write(level_path)
+    f.write(zlib.compress(''.join(chr(flags) for flags in recording.inputs)))
+
+def read_recording(f):
+    header = f.read(header_size)
+    if len(header) != header_size:
+        raise ValueError('Truncated recording')
+    file_magic, file_version, seed, dt, path_length = struct.unpack(
+        header_format, header)
+    if file_magic != magic or file_version != format_version:
+        raise ValueError('Not a recording of format version %d' %
+                         format_version)
+    recording = Recording(f.read(path_length), seed, dt)
+    recording.inputs = map(ord, zlib.decompress(f.read()))
+    return recording
+
+def save_recording(path, recording):
+    recording_dir = os.path.dirname(os.path.abspath(path))
+    level_path = os.path.abspath(recording.level_path)
+    try:
+        level_path = os.path.relpath(level_path, recording_dir)
+    except ValueError:
+        # The level is on another drive.
+        pass
+    f = open(path, 'wb')
+    try:
+        write_recording(f, recording, level_path)
+    finally:
+        f.close()
+
+def load_recording(path):
+    f = open(path, 'rb')
+    try:
+        recording = read_recording(f)
+    finally:
+        f.close()
+    recording.level_path = os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(path)), recording.level_path))
+    return recording
+
+def get_state_digest(level):
+    """
+    Return a hex digest of the time and the transforms and velocities of all
+    bodies, for checking that two runs are identical.
+    """
+    digest = hashlib.sha1(struct.pack('<d', level.time))
+    for body in level.world.bodyList:
+        p = body.position
+        v = body.linearVelocity
+        digest.update(struct.pack('<6d', p.x, p.y, body.angle, v.x, v.y,
+                                  body.angularVelocity))
+    return digest.hexdigest()
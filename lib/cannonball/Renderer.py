@@ -0,0 +1,385 @@
+from __future__ import division
+
+from cannonball.TextureManager import texture_manager
+
+import numpy
+import pyglet
+from pyglet.gl import *
+
+from math import *
+
+class Renderer(object):
+    """
+    Draw the meshes of all actors from vertex buffers, batched by texture.
+
+    Static bodies are baked into world space once, split into square tiles
+    of `tile_size`. Each triangle goes to the tile of its centroid and each
+    outline edge to the tile of its midpoint, and each tile holds one
+    vertex list per texture. Only the tiles that intersect the view are
+    drawn, so the cost of drawing the static world follows the view size,
+    not the level size. Visible tiles are drawn texture by texture, so each
+    texture is bound once per frame.
+
+    Dynamic bodies share one stream buffer per texture that is transformed
+    on the CPU every frame, so the number of draw calls depends on the
+    number of textures, not on the number of actors. Buffers are created
+    lazily on the first draw.
+    """
+
+    tile_size = 16
+
+    def __init__(self, level):
+        self.level = level
+        self.pending = []
+        self.tiles = {}
+        self.static_textures = []
+        self.tile_cells = {}
+        self.actor_tiles = {}
+        self.dirty_tiles = set()
+        self.dynamic_buffers = {}
+        self.dirty_textures = set()
+
+    def add_actor(self, actor):
+        self.pending.append(actor)
+
+    def remove_actor(self, actor):
+        if actor in self.pending:
+            self.pending.remove(actor)
+        for key in self.actor_tiles.pop(actor, ()):
+            self.tiles[key].remove(actor)
+            self.dirty_tiles.add(key)
+        for texture, buffer in self.dynamic_buffers.iteritems():
+            items = [item for item in buffer.items if item[0] is not actor]
+            if len(items) != len(buffer.items):
+                buffer.items = items
+                self.dirty_textures.add(texture)
+
+    def draw(self, min_x, min_y, max_x, max_y):
+        if self.pending:
+            self.upload()
+        for key in self.dirty_tiles:
+            self.tiles[key].build()
+        self.dirty_tiles.clear()
+        if self.dirty_textures:
+            for texture in self.dirty_textures:
+                self.dynamic_buffers[texture].rebuild(texture is not None)
+            self.dirty_textures.clear()
+        tiles = self.get_visible_tiles(min_x, min_y, max_x, max_y)
+        binds = 0
+        for texture in self.static_textures:
+            vertex_lists = [vertex_list for tile in tiles
+                            for vertex_list in tile.vertex_lists.get(texture,
+                                                                     ())]
+            if not vertex_lists:
+                continue
+            if texture:
+                binds += 1
+                glEnable(texture.target)
+                glBindTexture(texture.target, texture.id)
+            for mode, vertex_list in vertex_lists:
+                vertex_list.draw(mode)
+            if texture:
+                glDisable(texture.target)
+        binds += sum(1 for texture in self.dynamic_buffers if texture)
+        profiler = self.level.profiler
+        profiler.count('drawn_tiles', len(tiles))
+        profiler.count('texture_binds', binds)
+        profiler.count('texture_kb', texture_manager.memory_usage // 1024)
+        for texture, buffer in self.dynamic_buffers.iteritems():
+            buffer.update(self.level)
+            buffer.draw(texture)
+
+    def upload(self):
+        for actor in self.pending:
+            if actor.body is None:
+                continue
+            if actor.body.IsStatic():
+                self.upload_static(actor)
+            else:
+                for mesh in actor.meshes:
+                    texture = self.get_texture(mesh)
+                    if texture not in self.dynamic_buffers:
+                        self.dynamic_buffers[texture] = DynamicBuffer()
+                    self.dynamic_buffers[texture].items.append((actor, mesh))
+                    self.dirty_textures.add(texture)
+        del self.pending[:]
+
+    def upload_static(self, actor):
+        tile_keys = self.actor_tiles.setdefault(actor, set())
+        for mesh in actor.meshes:
+            texture = self.get_texture(mesh)
+            if texture not in self.static_textures:
+                self.static_textures.append(texture)
+            vertices, normals, tex_coords, colors = get_mesh_arrays(mesh,
+                                                                    texture)
+            for key, indices, triangles, edges in split_mesh(
+                vertices, mesh.triangles, self.tile_size):
+                if key not in self.tiles:
+                    self.tiles[key] = Tile()
+                self.tiles[key].add(actor, (texture, vertices[indices],
+                                            normals[indices],
+                                            tex_coords[indices],
+                                            colors[indices], triangles, edges))
+                tile_keys.add(key)
+                self.dirty_tiles.add(key)
+
+                # Triangles can reach outside their tile, so tiles are
+                # registered with every cell that their geometry overlaps.
+                tile_vertices = vertices[indices]
+                min_x, min_y = tile_vertices.min(axis=0)
+                max_x, max_y = tile_vertices.max(axis=0)
+                for cell in get_cells(min_x, min_y, max_x, max_y,
+                                      self.tile_size):
+                    self.tile_cells.setdefault(cell, set()).add(key)
+
+    def get_visible_tiles(self, min_x, min_y, max_x, max_y):
+        keys = set()
+        for cell in get_cells(min_x, min_y, max_x, max_y, self.tile_size):
+            keys.update(self.tile_cells.get(cell, ()))
+        return [self.tiles[key] for key in sorted(keys)]
+
+    def get_texture(self, mesh):
+        if mesh.texture:
+            return self.level.get_texture(mesh.texture)
+        return None
+
+class Tile(object):
+    """
+    The static geometry in one tile, as parts added by actors. Parts with
+    the same texture are merged into one vertex list for fills and one for
+    outlines.
+    """
+
+    def __init__(self):
+        self.parts = {}
+        self.vertex_lists = {}
+
+    def add(self, actor, part):
+        self.parts.setdefault(actor, []).append(part)
+
+    def remove(self, actor):
+        self.parts.pop(actor, None)
+
+    def build(self):
+        for vertex_lists in self.vertex_lists.itervalues():
+            for mode, vertex_list in vertex_lists:
+                vertex_list.delete()
+        self.vertex_lists.clear()
+        textures = {}
+        for parts in self.parts.itervalues():
+            for part in parts:
+                textures.setdefault(part[0], []).append(part)
+        for texture, parts in textures.iteritems():
+            vertex_lists = self.vertex_lists[texture] = []
+            triangle_indices = []
+            line_indices = []
+            count = 0
+            for part in parts:
+                triangles, edges = part[5], part[6]
+                triangle_indices.extend((triangles + count).ravel().tolist())
+                line_indices.extend((edges + count).ravel().tolist())
+                count += len(part[1])
+            data = [('v2f/static', numpy.concatenate([p[1] for p in parts])
+                     .ravel().tolist()),
+                    ('n3f/static', numpy.concatenate([p[2] for p in parts])
+                     .ravel().tolist()),
+                    ('c3f/static', numpy.concatenate([p[4] for p in parts])
+                     .ravel().tolist())]
+            if texture:
+                data.append(('t2f/static', numpy.concatenate(
+                    [p[3] for p in parts]).ravel().tolist()))
+            if triangle_indices:
+                vertex_lists.append((GL_TRIANGLES,
+                                     pyglet.graphics.vertex_list_indexed(
+                                         count, triangle_indices, *data)))
+            if line_indices:
+                vertex_lists.append((GL_LINES,
+                                     pyglet.graphics.vertex_list_indexed(
+                                         count, line_indices, *data)))
+
+class DynamicBuffer(object):
+    """
+    The meshes of all dynamic actors with the same texture, kept in body
+    space and transformed into world space in one step per frame.
+
+    Fills and outlines share one indexed vertex list. Its index buffer holds
+    the triangle indices followed by the line indices, and each range is
+    drawn with its own mode. The transformed vertices and normals are
+    written straight into the vertex list's arrays through numpy views.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.actors = []
+        self.vertex_list = None
+        self.triangles = None
+        self.lines = None
+        self.vertices = None
+        self.normals = None
+        self.body_indices = None
+
+    def rebuild(self, textured):
+        if self.vertex_list is not None:
+            self.vertex_list.delete()
+            self.vertex_list = None
+        vertex_chunks = []
+        normal_chunks = []
+        tex_coord_chunks = []
+        color_chunks = []
+        body_indices = []
+        triangle_indices = []
+        line_indices = []
+        self.actors = []
+        actor_indices = {}
+        count = 0
+        for actor, mesh in self.items:
+            if actor not in actor_indices:
+                actor_indices[actor] = len(self.actors)
+                self.actors.append(actor)
+            vertices, normals, tex_coords, colors = get_mesh_arrays(
+                mesh, textured)
+            vertex_chunks.append(vertices)
+            normal_chunks.append(normals)
+            tex_coord_chunks.append(tex_coords)
+            color_chunks.append(colors)
+            body_indices.extend([actor_indices[actor]] * len(vertices))
+            triangle_indices.extend(count + i for triangle in mesh.triangles
+                                    for i in triangle)
+            line_indices.extend(count + i for i in
+                                get_outline_indices(len(vertices)))
+            count += len(vertices)
+        if not count:
+            self.vertices = None
+            return
+        self.vertices = numpy.concatenate(vertex_chunks)
+        self.normals = numpy.concatenate(normal_chunks)
+        self.body_indices = numpy.array(body_indices)
+        data = [('v2f/stream', self.vertices.ravel().tolist()),
+                ('n3f/stream', self.normals.ravel().tolist()),
+                ('c3f/static', numpy.concatenate(color_chunks).ravel()
+                 .tolist())]
+        if textured:
+            data.append(('t2f/static', numpy.concatenate(tex_coord_chunks)
+                         .ravel().tolist()))
+        self.vertex_list = pyglet.graphics.vertex_list_indexed(
+            count, triangle_indices + line_indices, *data)
+        start = self.vertex_list.index_start
+        self.triangles = IndexRange(start, len(triangle_indices))
+        self.lines = IndexRange(start + len(triangle_indices),
+                                len(line_indices))
+
+    def update(self, level):
+        if self.vertices is None:
+            return
+        transforms = numpy.array([level.get_transform(a) for a in self.actors])
+        positions = transforms[:, :2][self.body_indices]
+        angles = transforms[:, 2]
+        cos_angles = numpy.cos(angles)[self.body_indices]
+        sin_angles = numpy.sin(angles)[self.body_indices]
+
+        # Each access to the arrays marks them for upload on the next draw.
+        vertices = as_array(self.vertex_list.vertices, 2)
+        normals = as_array(self.vertex_list.normals, 3)
+        x = self.vertices[:, 0]
+        y = self.vertices[:, 1]
+        vertices[:, 0] = cos_angles * x - sin_angles * y + positions[:, 0]
+        vertices[:, 1] = sin_angles * x + cos_angles * y + positions[:, 1]
+        x = self.normals[:, 0]
+        y = self.normals[:, 1]
+        normals[:, 0] = cos_angles * x - sin_angles * y
+        normals[:, 1] = sin_angles * x + cos_angles * y
+
+    def draw(self, texture):
+        if self.vertices is None:
+            return
+        if texture:
+            glEnable(texture.target)
+            glBindTexture(texture.target, texture.id)
+        domain = self.vertex_list.domain
+        domain.draw(GL_TRIANGLES, self.triangles)
+        domain.draw(GL_LINES, self.lines)
+        if texture:
+            glDisable(texture.target)
+
+class IndexRange(object):
+    """
+    A range of the index buffer of an indexed vertex domain, to pass to
+    `domain.draw` in place of a vertex list.
+    """
+
+    def __init__(self, index_start, index_count):
+        self.index_start = index_start
+        self.index_count = index_count
+
+def as_array(array, width):
+    """
+    Return a numpy view of a ctypes array of vertex attributes, with one
+    row per vertex.
+    """
+    return numpy.ctypeslib.as_array(array).reshape(-1, width)
+
+def get_mesh_arrays(mesh, textured):
+    vertices = numpy.array(mesh.vertices, dtype=numpy.float64).reshape(-1, 2)
+    normals = numpy.array(mesh.normals, dtype=numpy.float64).reshape(-1, 3)
+    tex_coords = vertices * 0.1
+    color = (1, 1, 1) if textured else mesh.color
+    colors = numpy.tile(numpy.array(color, dtype=numpy.float64),
+                        (len(vertices), 1))
+    return vertices, normals, tex_coords, colors
+
+def split_mesh(vertices, triangles, tile_size):
+    """
+    Split a mesh into tiles. Yield the tile key, the indices of the
+    vertices used in the tile, and the triangles and outline edges of the
+    tile as index arrays into those vertices.
+
+    >>> vertices = numpy.array([(0, 0), (2, 0), (3, 0), (3, 1), (1, 1),
+    ...                         (0, 1)], dtype=float)
+    >>> for key, indices, triangles, edges in split_mesh(
+    ...     vertices, [(0, 4, 5), (0, 1, 4), (1, 3, 4), (1, 2, 3)], 2):
+    ...     print key, indices.tolist(), triangles.tolist(), edges.tolist()
+    (0, 0) [0, 1, 4, 5] [[0, 2, 3], [0, 1, 2]] [[0, 1], [2, 3], [3, 0]]
+    (1, 0) [1, 2, 3, 4] [[0, 2, 3], [0, 1, 2]] [[0, 1], [1, 2], [2, 3]]
+    """
+    triangles = numpy.array(triangles, dtype=int).reshape(-1, 3)
+    n = len(vertices)
+    edges = numpy.column_stack([numpy.arange(n), (numpy.arange(n) + 1) % n])
+    groups = {}
+    centers = vertices[triangles].mean(axis=1)
+    for i, key in enumerate(numpy.floor(centers / tile_size).astype(int)
+                            .tolist()):
+        groups.setdefault(tuple(key), ([], []))[0].append(i)
+    midpoints = vertices[edges].mean(axis=1)
+    for i, key in enumerate(numpy.floor(midpoints / tile_size).astype(int)
+                            .tolist()):
+        groups.setdefault(tuple(key), ([], []))[1].append(i)
+    for key in sorted(groups):
+        triangle_rows, edge_rows = groups[key]
+        tile_triangles = triangles[triangle_rows].reshape(-1, 3)
+        tile_edges = edges[edge_rows].reshape(-1, 2)
+        indices = numpy.unique(numpy.concatenate([tile_triangles.ravel(),
+                                                  tile_edges.ravel()]))
+        yield (key, indices, numpy.searchsorted(indices, tile_triangles),
+               numpy.searchsorted(indices, tile_edges))
+
+def get_cells(min_x, min_y, max_x, max_y, cell_size):
+    """
+    >>> list(get_cells(-1, 0, 1, 0.5, 2))
+    [(-1, 0), (0, 0)]
+    """
+    for i in xrange(int(floor(min_x / cell_size)),
+                    int(floor(max_x / cell_size)) + 1):
+        for j in xrange(int(floor(min_y / cell_size)),
+                        int(floor(max_y / cell_size)) + 1):
+            yield i, j
+
+def get_outline_indices(count):
+    """
+    >>> get_outline_indices(3)
+    [0, 1, 1, 2, 2, 0]
+    """
+    indices = []
+    for i in xrange(count):
+        indices.append(i)
+        indices.append((i + 1) % count)
+    return indices
@@ -0,0 +1,112 @@
+from __future__ import division
+
+from math import *
+
+class SpatialIndex(object):
+    """
+    A uniform grid of actors by bounding box.
+
+    An actor is added with one box per shape, which stays exact for bodies
+    that do not move. Moving actors are kept as a single box padded by
+    `margin`, which is only replaced when the body leaves it. Queries
+    return each actor once, ordered by serial, however many of its boxes
+    overlap the query rectangle.
+
+    >>> class Item(object):
+    ...     def __init__(self, serial):
+    ...         self.serial = serial
+    >>> a, b = Item(0), Item(1)
+    >>> index = SpatialIndex(cell_size=2)
+    >>> index.add(a, [(0, 0, 1, 1), (10, 0, 11, 1)])
+    >>> index.add(b, [(5, 0, 6, 1)])
+    >>> [item.serial for item in index.query(0, 0, 12, 1)]
+    [0, 1]
+    >>> [item.serial for item in index.query(4, 0, 9, 1)]
+    [1]
+    >>> index.move(b, (20, 0, 21, 1))
+    >>> [item.serial for item in index.query(4, 0, 9, 1)]
+    []
+    >>> index.remove(a)
+    >>> [item.serial for item in index.query(0, 0, 30, 1)]
+    [1]
+    """
+
+    def __init__(self, cell_size=4, margin=0.5):
+        self.cell_size = cell_size
+        self.margin = margin
+        self.cells = {}
+        self.entries = {}
+        self.seen = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, actor):
+        return actor in self.entries
+
+    def get_cell(self, x, y):
+        return (int(floor(x / self.cell_size)),
+                int(floor(y / self.cell_size)))
+
+    def get_cells(self, min_x, min_y, max_x, max_y):
+        min_i, min_j = self.get_cell(min_x, min_y)
+        max_i, max_j = self.get_cell(max_x, max_y)
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self.cells):
+            return self.cells.keys()
+        return [(i, j) for i in xrange(min_i, max_i + 1)
+                for j in xrange(min_j, max_j + 1)]
+
+    def add(self, actor, boxes):
+        items = []
+        for box in boxes:
+            item = actor, box
+            min_i, min_j = self.get_cell(box[0], box[1])
+            max_i, max_j = self.get_cell(box[2], box[3])
+            for i in xrange(min_i, max_i + 1):
+                for j in xrange(min_j, max_j + 1):
+                    self.cells.setdefault((i, j), set()).add(item)
+                    items.append(((i, j), item))
+        self.entries[actor] = boxes, items
+
+    def remove(self, actor):
+        boxes, items = self.entries.pop(actor, ((), ()))
+        for key, item in items:
+            cell = self.cells[key]
+            cell.discard(item)
+            if not cell:
+                del self.cells[key]
+
+    def move(self, actor, box):
+        """
+        Update a moving actor with its current bounding box.
+        """
+        boxes, items = self.entries.get(actor, ((), ()))
+        if len(boxes) == 1:
+            min_x, min_y, max_x, max_y = boxes[0]
+            if (box[0] >= min_x and box[1] >= min_y and box[2] <= max_x and
+                box[3] <= max_y):
+                return
+        self.remove(actor)
+        margin = self.margin
+        self.add(actor, [(box[0] - margin, box[1] - margin,
+                          box[2] + margin, box[3] + margin)])
+
+    def query(self, min_x, min_y, max_x, max_y, result=None):
+        """
+        Return the actors with a box that overlaps a rectangle. The result
+        list is cleared and reused if given.
+        """
+        if result is None:
+            result = []
+        else:
+            del result[:]
+        seen = self.seen
+        for key in self.get_cells(min_x, min_y, max_x, max_y):
+            for actor, box in self.cells.get(key, ()):
+                if (actor not in seen and box[0] <= max_x and
+                    box[1] <= max_y and box[2] >= min_x and box[3] >= min_y):
+                    seen.add(actor)
+                    result.append(actor)
+        seen.clear()
+        result.sort(key=lambda actor: actor.serial)
+        return result
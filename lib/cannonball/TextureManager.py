@@ -0,0 +1,87 @@
+from __future__ import division
+
+import pyglet
+import pyglet.image.atlas
+from pyglet.gl import *
+
+import os
+import threading
+
+class TextureManager(object):
+    """
+    Textures shared by all levels and actors, keyed by absolute path.
+
+    Textures that are drawn with coordinates in the unit square, like
+    particles, can be packed into a shared atlas and are returned as regions
+    with remapped texture coordinates. Level textures are repeated across
+    world coordinates, which an atlas cannot do without shaders, so they get
+    textures of their own, with mipmaps if their sides are powers of two.
+    """
+
+    atlas_size = 1024
+    max_atlas_image_size = 256
+
+    def __init__(self):
+        self.textures = {}
+        self.images = {}
+        self.lock = threading.Lock()
+        self.atlas = None
+        self.memory_usage = 0
+
+    def get_texture(self, path, atlas=False):
+        path = os.path.abspath(path)
+        key = path, atlas
+        if key not in self.textures:
+            with self.lock:
+                image = self.images.pop(path, None)
+            if image is None:
+                image = pyglet.image.load(path)
+            if (atlas and image.width <= self.max_atlas_image_size and
+                image.height <= self.max_atlas_image_size):
+                if self.atlas is None:
+                    self.atlas = pyglet.image.atlas.TextureBin(
+                        self.atlas_size, self.atlas_size)
+                atlas_count = len(self.atlas.atlases)
+                texture = self.atlas.add(image)
+                if len(self.atlas.atlases) != atlas_count:
+                    self.memory_usage += 4 * self.atlas_size ** 2
+            elif (is_power_of_two(image.width) and
+                  is_power_of_two(image.height)):
+                texture = image.get_mipmapped_texture()
+
+                # A full chain of mipmaps adds a third.
+                self.memory_usage += (4 * texture.width * texture.height *
+                                      4 // 3)
+            else:
+                # Mipmaps need sides that are powers of two.
+                texture = image.get_texture()
+                self.memory_usage += 4 * texture.width * texture.height
+            self.textures[key] = texture
+        return self.textures[key]
+
+    def load_image(self, path):
+        """
+        Decode an image for a later call to `get_texture`.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            if path in self.images or (path, False) in self.textures:
+                return
+        image = pyglet.image.load(path)
+        with self.lock:
+            self.images[path] = image
+
+    def get_report(self):
+        atlas_count = len(self.atlas.atlases) if self.atlas else 0
+        return ('%d textures, %d atlases, %.1f MB of texture memory' %
+                (len(self.textures), atlas_count,
+                 self.memory_usage / (1 << 20)))
+
+def is_power_of_two(n):
+    """
+    >>> [n for n in xrange(10) if is_power_of_two(n)]
+    [1, 2, 4, 8]
+    """
+    return n > 0 and n & (n - 1) == 0
+
+texture_manager = TextureManager()
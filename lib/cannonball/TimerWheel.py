@@ -0,0 +1,108 @@
+from itertools import count
+
+class Timer(object):
+    def __init__(self, tick, serial, callback, args):
+        self.tick = tick
+        self.serial = serial
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+class TimerWheel(object):
+    """
+    Timers on a hierarchical wheel of simulation ticks.
+
+    Each wheel has `slot_count` slots. A slot in the first wheel holds the
+    timers for one tick, and a slot in each following wheel spans all the
+    slots of the wheel before it. A timer goes in the first wheel whose
+    span covers its delay, so scheduling takes constant time. When a wheel
+    comes around, the next slot of the wheel after it is cascaded down.
+    Cancelled timers are flagged and dropped when their slot comes up.
+
+    Timers that expire on the same tick are returned in the order they were
+    scheduled.
+
+    >>> wheel = TimerWheel()
+    >>> timers = [wheel.schedule(ticks, None) for ticks in (300, 1, 300, 2)]
+    >>> wheel.cancel(timers[2])
+    >>> expired = []
+    >>> for tick in xrange(1000):
+    ...     expired.extend((t.tick, t.serial) for t in wheel.advance())
+    >>> expired
+    [(1, 1), (2, 3), (300, 0)]
+    >>> len(wheel)
+    0
+    """
+
+    slot_bits = 8
+    wheel_count = 4
+
+    def __init__(self):
+        self.tick = 0
+        self.serials = count()
+        self.slot_count = 1 << self.slot_bits
+        self.wheels = [[[] for _ in xrange(self.slot_count)]
+                       for _ in xrange(self.wheel_count)]
+
+        # Timers beyond the span of the last wheel.
+        self.overflow = []
+
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def schedule(self, ticks, callback, *args):
+        """
+        Schedule a callback to be returned by `advance` after the given
+        number of ticks, at least one.
+        """
+        timer = Timer(self.tick + max(1, ticks), self.serials.next(),
+                      callback, args)
+        self.add(timer)
+        self.pending += 1
+        return timer
+
+    def cancel(self, timer):
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.pending -= 1
+
+    def add(self, timer):
+        delay = timer.tick - self.tick
+        for i, wheel in enumerate(self.wheels):
+            shift = self.slot_bits * i
+            if delay < 1 << (shift + self.slot_bits):
+                wheel[(timer.tick >> shift) % self.slot_count].append(timer)
+                return
+        self.overflow.append(timer)
+
+    def advance(self):
+        """
+        Advance by one tick and return the timers that expired, in one
+        batch.
+        """
+        self.tick += 1
+        for i in xrange(self.wheel_count - 1, 0, -1):
+            shift = self.slot_bits * i
+            if self.tick % (1 << shift) == 0:
+                if i == self.wheel_count - 1 and self.tick % (
+                    1 << (shift + self.slot_bits)) == 0:
+                    self.cascade(self.overflow)
+                self.cascade(self.wheels[i][(self.tick >> shift) %
+                                            self.slot_count])
+        slot = self.wheels[0][self.tick % self.slot_count]
+        expired = [timer for timer in slot if not timer.cancelled]
+        del slot[:]
+        expired.sort(key=lambda timer: timer.serial)
+        for timer in expired:
+            timer.cancelled = True
+        self.pending -= len(expired)
+        return expired
+
+    def cascade(self, timers):
+        moved = timers[:]
+        del timers[:]
+        for timer in moved:
+            if not timer.cancelled:
+                self.add(timer)
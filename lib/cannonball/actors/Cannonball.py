@@ -1,4 +1,4 @@
-from cannonball.Actor import Actor
+from cannonball.Actor import Actor, cannonball_category
 
 from Box2D import *
 import pyglet
@@ -10,9 +10,18 @@ def sign(x):
     return x / abs(x) if x else 0
 
 class Cannonball(Actor):
+    __slots__ = ('won', 'lost', 'cannon_dict', 'cannon_list', 'cannon_index',
+                 'rolling_left', 'rolling_right', 'switching_cannon',
+                 'firing')
+
+    category = cannonball_category
+
     max_angular_velocity = 15
     max_angular_acceleration = 10
 
+    # Input state, packed into bit flags for recordings.
+    input_names = 'rolling_left', 'rolling_right', 'switching_cannon', 'firing'
+
     def __init__(self, level):
         super(Cannonball, self).__init__(level)
         self.id = 'cannonball'
@@ -100,8 +109,20 @@ class Cannonball(Actor):
         shape_def.friction = 5
         shape_def.restitution = 0.5
         shape_def.filter.groupIndex = -1
+        shape_def.filter.categoryBits = self.category
         shape = self.body.CreateShape(shape_def)
-        shape.SetUserData({'color': (0.3, 0.3, 0.3)})
+        self.set_material(shape, (0.3, 0.3, 0.3))
+
+    def get_input_flags(self):
+        flags = 0
+        for i, name in enumerate(self.input_names):
+            if getattr(self, name):
+                flags |= 1 << i
+        return flags
+
+    def set_input_flags(self, flags):
+        for i, name in enumerate(self.input_names):
+            setattr(self, name, bool(flags & (1 << i)))
 
     def on_key_press(self, symbol, modifiers):
         if symbol == pyglet.window.key.LEFT:
@@ -1,10 +1,15 @@
-from cannonball.Actor import Actor
+from cannonball.Actor import Actor, cannonball_category, pickup_category
 
 from Box2D import *
 
 import random
 
 class Goal(Actor):
+    __slots__ = ()
+
+    category = pickup_category
+    contact_mask = cannonball_category
+
     def collide(self, other):
         if not self in self.level.destroying and other.id == 'cannonball':
             self.level.destroying.add(self)
@@ -1,4 +1,4 @@
-from cannonball.Actor import Actor
+from cannonball.Actor import Actor, cannonball_category, pickup_category
 
 from Box2D import *
 from pyglet.gl import *
@@ -7,6 +7,11 @@ from math import *
 import random
 
 class GrapplingGunUpgrade(Actor):
+    __slots__ = ()
+
+    category = pickup_category
+    contact_mask = cannonball_category
+
     def collide(self, other):
         if not self in self.level.destroying and other.id == 'cannonball':
             self.level.destroying.add(self)
@@ -58,7 +63,8 @@ class GrapplingGun(object):
             glColor3d(0, 1, 0)
             glNormal3d(0, 0, 1)
             glBegin(GL_LINES)
-            glVertex2d(*self.cannonball.body.position.tuple())
+            level = self.cannonball.level
+            glVertex2d(*level.get_transform(self.cannonball)[:2])
             glVertex2d(*self.anchor.tuple())
             glEnd()
 
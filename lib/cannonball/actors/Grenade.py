@@ -1,22 +1,43 @@
-from cannonball.actors.Smoke import Smoke
-from cannonball.Actor import Actor
+from cannonball.Actor import Actor, all_categories, grenade_category
+from cannonball.Level import step_falloff
 
 from Box2D import *
 
 import random
 
 class Grenade(Actor):
+    __slots__ = 'fuse',
+
     z = 0.1
+    category = grenade_category
+    contact_mask = all_categories
+    pooled = True
+
+    # Seconds before a grenade that has not hit anything explodes.
+    fuse_time = 3
     
     def __init__(self, level, position, linear_velocity):
         super(Grenade, self).__init__(level)
         self._create_body(position, linear_velocity)
+        self.fuse = level.schedule(self.fuse_time, self.explode)
+
+    def activate(self, position, linear_velocity):
+        self.unpark(position)
+        self.body.linearVelocity = linear_velocity
+        self.body.angularVelocity = 0
+        self.fuse = self.level.schedule(self.fuse_time, self.explode)
 
     def collide(self, other):
-        if not self in self.level.destroying:
+        self.explode()
+
+    def explode(self):
+        # The body is gone if the grenade left the world.
+        if self.body and not self in self.level.destroying:
+            self.level.cancel(self.fuse)
             self.level.destroying.add(self)
-            self._create_shock_wave(1, 50)
-            self._create_shock_wave(2, 50)
+            # 100 within 1 of the grenade and 50 within 2, as when it
+            # made two shock waves.
+            self.level.explode(self.body.position, 2, 100, step_falloff)
             for _ in xrange(10):
                 self._create_smoke()
 
@@ -35,21 +56,12 @@ class Grenade(Actor):
         shape_def.density = 2
         shape_def.restitution = 0.5
         shape_def.filter.groupIndex = -1
+        shape_def.filter.categoryBits = self.category
         shape = self.body.CreateShape(shape_def)
-        shape.SetUserData({'color': (1, 0, 0)})
-
-    def _create_shock_wave(self, radius, impulse):
-        aabb = b2AABB()
-        aabb.lowerBound = self.body.position - b2Vec2(radius, radius)
-        aabb.upperBound = self.body.position + b2Vec2(radius, radius)
-        count, shapes = self.level.world.Query(aabb, 1000)
-        bodies = set(s.GetBody() for s in shapes)
-        for body in bodies:
-            unit = body.GetWorldCenter() - self.body.position
-            unit.Normalize()
-            body.ApplyImpulse(unit * impulse, body.GetWorldCenter())
+        self.set_material(shape, (1, 0, 0))
 
     def _create_smoke(self):
-        smoke = Smoke(self.level, self.body.position, self.body.linearVelocity)
+        random = self.level.random
         impulse = 3 * b2Vec2(random.random() - 0.5, random.random() - 0.5)
-        smoke.body.ApplyImpulse(impulse, smoke.body.position)
+        self.level.particles.emit(self.body.position, self.body.linearVelocity,
+                                  impulse)
@@ -1,5 +1,5 @@
 from cannonball.actors.Grenade import Grenade
-from cannonball.Actor import Actor
+from cannonball.Actor import Actor, cannonball_category, pickup_category
 
 from Box2D import *
 
@@ -7,6 +7,11 @@ from math import *
 import random
 
 class GrenadeLauncherUpgrade(Actor):
+    __slots__ = ()
+
+    category = pickup_category
+    contact_mask = cannonball_category
+
     def collide(self, other):
         if not self in self.level.destroying and other.id == 'cannonball':
             self.level.destroying.add(self)
@@ -37,7 +42,7 @@ class GrenadeLauncher(object):
         unit = b2Vec2(cos(angle), sin(angle))
         position = self.cannonball.body.position + 0.5 * unit
         linear_velocity = self.cannonball.body.linearVelocity
-        grenade = Grenade(level, position, linear_velocity)
+        grenade = level.create_actor(Grenade, position, linear_velocity)
         impulse = unit * 10
         grenade.body.ApplyImpulse(impulse, grenade.body.position)
         self.cannonball.body.ApplyImpulse(-impulse,
@@ -1,5 +1,4 @@
-from cannonball.Actor import Actor
-from cannonball.actors.Smoke import Smoke
+from cannonball.Actor import Actor, cannonball_category, pickup_category
 
 from Box2D import *
 
@@ -8,6 +7,11 @@ import random
 import time
 
 class JetEngineUpgrade(Actor):
+    __slots__ = ()
+
+    category = pickup_category
+    contact_mask = cannonball_category
+
     def collide(self, other):
         if not self in self.level.destroying and other.id == 'cannonball':
             self.level.destroying.add(self)
@@ -39,9 +43,9 @@ class JetEngine(object):
         unit = b2Vec2(cos(angle), sin(angle))
         position = self.cannonball.body.position + 0.5 * unit
         linear_velocity = self.cannonball.body.linearVelocity
-        smoke = Smoke(level, position, linear_velocity)
+        random = level.random
         impulse = 2 * (unit + b2Vec2(random.random() - 0.5,
                                      random.random() - 0.5))
-        smoke.body.ApplyImpulse(impulse, smoke.body.position)
+        level.particles.emit(position, linear_velocity, impulse)
         self.cannonball.body.ApplyImpulse(-impulse,
                                           self.cannonball.body.position)
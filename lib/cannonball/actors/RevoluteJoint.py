@@ -1,9 +1,13 @@
 from cannonball.Actor import Actor
+from cannonball.LevelCompiler import *
 from cannonball.svg import *
 
 class RevoluteJoint(Actor):
-    def load(self, element, transform):
-        transform = transform * Transform(element.getAttribute('transform'))
-        center = (float(element.getAttribute('sodipodi:cx')),
-                  float(element.getAttribute('sodipodi:cy')))
-        self.level.joints.append(transform * center)
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, compiler, element, transform):
+        transform = transform * Transform(get_attribute(element, 'transform'))
+        center = (float(get_attribute(element, 'sodipodi:cx')),
+                  float(get_attribute(element, 'sodipodi:cy')))
+        compiler.data.joints.append(transform * center)
@@ -0,0 +1,307 @@
+"""
+Level benchmarks for loading, stepping and drawing.
+
+Run with `python -m cannonball.benchmarks.levels` to time every stage over
+the shipped levels and synthetic stress levels. Results are written as JSON
+with `--output`, and compared against a saved run with `--baseline`. The
+exit status is 1 if any stage is slower than the baseline by more than the
+threshold.
+"""
+
+from __future__ import division
+
+import pyglet
+
+# Levels are stepped without a window unless drawing is measured.
+pyglet.options['shadow_window'] = False
+
+from cannonball.Level import *
+from cannonball.LevelCompiler import *
+from cannonball.memory import get_legacy_level_size, get_level_size
+from cannonball.svg import *
+
+from glob import glob
+from math import *
+from optparse import OptionParser
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+root = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                    os.pardir)
+levels_dir = os.path.normpath(os.path.join(root, 'content', 'levels'))
+stress_sizes = [100, 1000]
+
+def create_stress_level(path, body_count, seed=0):
+    """
+    Write a level with a grid of curved blobs. Every fourth blob is
+    dynamic, so that bodies fall, collide and come to rest.
+    """
+    random.seed(seed)
+    columns = int(ceil(sqrt(body_count)))
+    size = 100
+    width = (columns + 2) * size
+    height = (columns + 4) * size
+    f = open(path, 'w')
+    try:
+        f.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+                '<svg xmlns="http://www.w3.org/2000/svg"\n'
+                '   xmlns:sodipodi="%s"\n'
+                '   xmlns:inkscape="%s"\n'
+                '   width="%d" height="%d">\n'
+                '  <sodipodi:namedview id="namedview" pagecolor="#62b5df" />\n'
+                '  <g inkscape:groupmode="layer" id="layer1">\n'
+                % (namespaces['sodipodi'], namespaces['inkscape'], width,
+                   height))
+        f.write('    <path id="start" inkscape:label="sensor: true" '
+                'style="fill:#00ff00" d="M 10,10 L 90,10 L 90,90 L 10,90 z" '
+                '/>\n')
+        for i in xrange(body_count):
+            x = (i % columns + 1.5) * size
+            y = (i // columns + 3.5) * size
+            label = 'density: 5' if i % 4 == 0 else ''
+            f.write('    <path id="body%d" inkscape:label="%s" '
+                    'style="fill:#808080" d="%s" />\n'
+                    % (i, label, create_blob_path(x, y, 0.3 * size)))
+        f.write('  </g>\n'
+                '  <text id="scale"><tspan>page-width: %gm</tspan></text>\n'
+                '</svg>\n' % (width * 0.05))
+    finally:
+        f.close()
+
+def create_blob_path(x, y, radius, count=8):
+    points = []
+    for i in xrange(3 * count):
+        angle = 2 * pi * i / (3 * count)
+        r = radius * (0.7 + 0.3 * random.random())
+        points.append((x + r * cos(angle), y + r * sin(angle)))
+    commands = ['M %g,%g' % points[0]]
+    for i in xrange(count):
+        c1, c2, p = [points[(3 * i + j) % len(points)] for j in (1, 2, 3)]
+        commands.append('C %g,%g %g,%g %g,%g' % (c1 + c2 + p))
+    commands.append('z')
+    return ' '.join(commands)
+
+def best_time(function, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = default_timer()
+        function()
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def percentile(times, fraction):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(fraction * len(times)))]
+
+def get_subpaths(path):
+    subpaths = []
+    for event, element, parents in stream_elements(path):
+        if event == 'end' and get_name(element) == 'path':
+            d = get_attribute(element, 'd')
+            if d:
+                subpaths.extend(Path(d).subpaths)
+    return subpaths
+
+def benchmark_load(path, repeat):
+    results = {}
+    def parse():
+        for _ in stream_elements(path):
+            pass
+    results['parse'] = best_time(parse, repeat)
+
+    tolerance = LevelCompiler.collision_tolerance
+    subpaths = get_subpaths(path)
+    results['linearize'] = best_time(
+        lambda: [s.linearize(tolerance) for s in subpaths], repeat)
+
+    polygons = [s.linearize(tolerance).normalize() for s in subpaths]
+    polygons = [p for p in polygons if len(p) >= 3]
+    results['triangulate'] = best_time(
+        lambda: [p.triangle_indices() for p in polygons], repeat)
+
+    results['compile'] = best_time(lambda: LevelCompiler().compile(path),
+                                   repeat)
+    data = LevelCompiler().compile(path)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        cache_path = os.path.join(temp_dir, 'level.cbl')
+        digest = get_digest(path)
+        f = open(cache_path, 'wb')
+        try:
+            write_level_data(f, data, digest)
+        finally:
+            f.close()
+        def read_cache():
+            f = open(cache_path, 'rb')
+            try:
+                read_level_data(f, digest)
+            finally:
+                f.close()
+        results['read_cache'] = best_time(read_cache, repeat)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    results['create_bodies'] = best_time(lambda: Level(path, data), repeat)
+    return data, results
+
+def benchmark_step(path, data, ticks, dt=1 / 60):
+    level = Level(path, data, seed=0)
+    cannonball = level.create_cannonball()
+    cannonball.rolling_right = True
+    dispatch_times = []
+    dispatch_contacts = level.dispatch_contacts
+    def timed_dispatch_contacts():
+        start = default_timer()
+        dispatch_contacts()
+        dispatch_times.append(default_timer() - start)
+    level.dispatch_contacts = timed_dispatch_contacts
+    step_times = []
+    for _ in xrange(ticks):
+        start = default_timer()
+        level.step(dt)
+        step_times.append(default_timer() - start)
+    return {
+        'memory_kb': get_level_size(level) / 1024,
+        'legacy_memory_kb': get_legacy_level_size(level) / 1024,
+        'step_mean': sum(step_times) / len(step_times),
+        'step_p95': percentile(step_times, 0.95),
+        'step_max': max(step_times),
+        'dispatch_mean': sum(dispatch_times) / len(dispatch_times),
+    }
+
+def benchmark_draw(window, path, data, frames):
+    from cannonball.Camera import Camera
+    window.switch_to()
+    level = Level(path, data, seed=0)
+    level.create_cannonball()
+    camera = Camera(window, level)
+    camera.step(0)
+
+    # The first frame uploads buffers and compiles display lists.
+    start = default_timer()
+    camera.draw()
+    glFinish()
+    first_frame = default_timer() - start
+
+    frame_times = []
+    for _ in xrange(frames):
+        start = default_timer()
+        camera.draw()
+        glFinish()
+        frame_times.append(default_timer() - start)
+    return {
+        'draw_first': first_frame,
+        'draw_mean': sum(frame_times) / len(frame_times),
+        'draw_p95': percentile(frame_times, 0.95),
+    }
+
+def create_window():
+    """
+    Return a hidden window to draw into, or None if there is no display.
+    """
+    try:
+        import pyglet.window
+        return pyglet.window.Window(visible=False)
+    except Exception, e:
+        print >> sys.stderr, 'Not measuring draw: %s' % e
+        return None
+
+def compare(results, baseline, threshold):
+    """
+    Return (level, stage, old, new) for every stage that is slower than the
+    baseline by more than the threshold.
+
+    >>> compare({'a': {'step': 0.3, 'draw': 0.1}},
+    ...         {'a': {'step': 0.2, 'draw': 0.1}}, 0.2)
+    [('a', 'step', 0.2, 0.3)]
+    """
+    regressions = []
+    for name in sorted(results):
+        for stage in sorted(results[name]):
+            old = baseline.get(name, {}).get(stage)
+            new = results[name][stage]
+            if old is not None and new > old * (1 + threshold):
+                regressions.append((name, stage, old, new))
+    return regressions
+
+def main():
+    parser = OptionParser(usage='python -m cannonball.benchmarks.levels '
+                                '[options] [level ...]')
+    parser.add_option('-o', '--output', help='write results as JSON to FILE',
+                      metavar='FILE')
+    parser.add_option('-b', '--baseline', metavar='FILE',
+                      help='compare against results saved in FILE')
+    parser.add_option('-t', '--threshold', type='float', default=0.2,
+                      help='allowed slowdown before a stage is flagged '
+                           '[default: %default]')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='runs per load stage [default: %default]')
+    parser.add_option('-n', '--ticks', type='int', default=600,
+                      help='physics steps per level [default: %default]')
+    parser.add_option('-f', '--frames', type='int', default=100,
+                      help='frames drawn per level [default: %default]')
+    parser.add_option('--no-draw', action='store_true',
+                      help='do not measure drawing')
+    parser.add_option('--no-stress', action='store_true',
+                      help='do not generate stress levels')
+    options, args = parser.parse_args()
+
+    paths = args or sorted(glob(os.path.join(levels_dir, '*.svg')))
+    levels = [(os.path.splitext(os.path.basename(p))[0], p) for p in paths]
+    temp_dir = tempfile.mkdtemp()
+    window = None if options.no_draw else create_window()
+    results = {}
+    try:
+        if not options.no_stress:
+            for size in stress_sizes:
+                path = os.path.join(temp_dir, 'stress-%d.svg' % size)
+                create_stress_level(path, size)
+                levels.append(('stress-%d' % size, path))
+        for name, path in levels:
+            print >> sys.stderr, 'Benchmarking %s...' % name
+            data, level_results = benchmark_load(path, options.repeat)
+            level_results.update(benchmark_step(path, data, options.ticks))
+            if window is not None:
+                level_results.update(benchmark_draw(window, path, data,
+                                                    options.frames))
+            results[name] = level_results
+    finally:
+        if window is not None:
+            window.close()
+        shutil.rmtree(temp_dir)
+
+    stages = sorted(set(s for r in results.itervalues() for s in r))
+    print '%-14s %s' % ('level', ' '.join('%13s' % s for s in stages))
+    for name in sorted(results):
+        print '%-14s %s' % (name, ' '.join('%13.6f' % results[name][s]
+                                           if s in results[name] else
+                                           '%13s' % '-' for s in stages))
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump({'results': results}, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    if options.baseline:
+        f = open(options.baseline)
+        try:
+            baseline = json.load(f)['results']
+        finally:
+            f.close()
+        regressions = compare(results, baseline, options.threshold)
+        for name, stage, old, new in regressions:
+            print 'Regression: %s %s %.6f -> %.6f (%+.0f%%)' % (
+                name, stage, old, new, 100 * (new / old - 1))
+        if regressions:
+            sys.exit(1)
+        print 'No regressions beyond %.0f%%' % (100 * options.threshold)
+
+if __name__ == '__main__':
+    main()
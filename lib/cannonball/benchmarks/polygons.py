@@ -0,0 +1,106 @@
+"""
+Polygon benchmark corpus for triangulation.
+
+Run with `python -m cannonball.benchmarks.polygons` to time
+`Polygon.triangulate` over every polygon family at sizes from 10 to 10,000
+vertices.
+"""
+
+from __future__ import division
+
+from cannonball.svg import *
+
+import numpy
+
+from math import *
+import random
+import sys
+from timeit import default_timer
+
+sizes = [10, 30, 100, 300, 1000, 3000, 10000]
+
+def create_circle(n):
+    angles = numpy.arange(n) * 2 * pi / n
+    return numpy.column_stack([numpy.cos(angles), numpy.sin(angles)])
+
+def create_star(n):
+    angles = numpy.arange(n) * 2 * pi / n
+    radii = numpy.where(numpy.arange(n) % 2, 0.5, 1)
+    return numpy.column_stack([radii * numpy.cos(angles),
+                               radii * numpy.sin(angles)])
+
+def create_coastline(n, seed=0):
+    random.seed(seed)
+    angles = numpy.arange(n) * 2 * pi / n
+    noise = numpy.array([random.random() for _ in xrange(n)])
+    radii = 1 + 0.5 * numpy.convolve(numpy.tile(noise, 3), [0.2] * 5,
+                                     'same')[n:2 * n]
+    return numpy.column_stack([radii * numpy.cos(angles),
+                               radii * numpy.sin(angles)])
+
+def create_comb(n):
+    teeth = max(1, (n - 2) // 4)
+    vertices = [(teeth * 2, -1), (teeth * 2, 0)]
+    for i in reversed(xrange(teeth)):
+        x = i * 2
+        vertices.extend([(x + 1, 0), (x + 1, 10), (x, 10), (x, 0)])
+    return as_vertex_array(vertices)[::-1]
+
+def create_spiral(n, turns=3):
+    half = n // 2
+    angles = numpy.linspace(0, 2 * pi * turns, half)
+    inner = 1 + angles / (2 * pi)
+    outer = inner + 0.5
+    curve = numpy.column_stack([numpy.cos(angles), numpy.sin(angles)])
+    return numpy.concatenate([curve * outer[:, numpy.newaxis],
+                              (curve * inner[:, numpy.newaxis])[::-1]])
+
+def create_collinear(n):
+    side = max(1, n // 4)
+    t = numpy.arange(side) / side
+    zeros = numpy.zeros(side)
+    ones = numpy.ones(side)
+    return numpy.concatenate([numpy.column_stack([t, zeros]),
+                              numpy.column_stack([ones, t]),
+                              numpy.column_stack([1 - t, ones]),
+                              numpy.column_stack([zeros, 1 - t])])
+
+families = [
+    ('circle', create_circle),
+    ('star', create_star),
+    ('coastline', create_coastline),
+    ('comb', create_comb),
+    ('spiral', create_spiral),
+    ('collinear', create_collinear),
+]
+
+def create_corpus(sizes=sizes):
+    for name, create in families:
+        for size in sizes:
+            yield name, size, Polygon(create(size))
+
+def benchmark(polygon, repeat=3):
+    best = None
+    for _ in xrange(repeat):
+        start = default_timer()
+        triangles = polygon.triangle_indices()
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(triangles)
+
+def main():
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else sizes[-1]
+    print '%-10s %8s %10s %12s %12s' % ('family', 'vertices', 'triangles',
+                                         'seconds', 'us/vertex')
+    for name, size, polygon in create_corpus([s for s in sizes
+                                              if s <= max_size]):
+        if not polygon.clockwise:
+            polygon = Polygon(polygon.array[::-1])
+        elapsed, triangle_count = benchmark(polygon)
+        print '%-10s %8d %10d %12.6f %12.3f' % (name, len(polygon),
+                                                 triangle_count, elapsed,
+                                                 1e6 * elapsed /
+                                                 max(1, len(polygon)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Compile and validate every level SVG in a content tree.
+
+Run with `cannonball-compile [options] [path ...]` to compile levels across
+a pool of worker processes, one level per worker, and write the cache file
+next to each SVG, where the game reads it. Levels whose cache is current
+are skipped unless `--force` is given. A summary of per-level timings and
+failures is printed, and written as JSON with `--summary`. The exit status
+is 1 if any level failed.
+"""
+
+from __future__ import division
+
+import pyglet
+
+# Levels are compiled without a window.
+pyglet.options['shadow_window'] = False
+
+from cannonball.LevelCompiler import *
+
+import json
+import multiprocessing
+from optparse import OptionParser
+import os
+import sys
+from timeit import default_timer
+import traceback
+
+root = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+content_dir = os.path.normpath(os.path.join(root, 'content'))
+
+def find_levels(paths):
+    """
+    Return the level SVGs under the given files and directories, sorted.
+    """
+    levels = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for name in file_names:
+                    if name.endswith('.svg'):
+                        levels.add(os.path.join(dir_path, name))
+        else:
+            levels.add(path)
+    return sorted(levels)
+
+def get_joint_body_count(data, position):
+    """
+    Return the number of bodies with a shape whose bounding box contains a
+    joint position. The game connects a joint only if there are exactly
+    two.
+    """
+    x, y = position
+    count = 0
+    for body_data in data.bodies:
+        for shape_data in body_data.shapes:
+            xs = [v[0] for v in shape_data.vertices]
+            ys = [v[1] for v in shape_data.vertices]
+            if min(xs) <= x <= max(xs) and min(ys) <= y <= max(ys):
+                count += 1
+                break
+    return count
+
+def validate_level_data(data):
+    """
+    Return a list of problems with compiled level data that would only
+    show up when the level is played.
+    """
+    problems = []
+    for body_data in data.bodies:
+        try:
+            get_actor_class(body_data.actor_name)
+        except (ImportError, AttributeError):
+            problems.append('Body %s: unknown actor class %s' %
+                            (body_data.id, body_data.actor_name))
+    if not any(body_data.id == 'start' for body_data in data.bodies):
+        problems.append('No start body')
+    for x, y in data.joints:
+        count = get_joint_body_count(data, (x, y))
+        if count != 2:
+            problems.append('Joint at (%g, %g) connects %d bodies' %
+                            (x, y, count))
+    return problems
+
+def compile_one(args):
+    """
+    Compile and validate one level in a worker process. Return a result
+    dictionary, so that failures are reported instead of stopping the
+    pool.
+    """
+    path, force = args
+    result = {'path': path, 'problems': []}
+    start = default_timer()
+    try:
+        if not force and is_cache_current(path):
+            result['status'] = 'unchanged'
+        else:
+            digest = get_digest(path)
+            data = LevelCompiler().compile(path)
+            result['problems'] = validate_level_data(data)
+
+            # Invalid levels get no cache, so that they are compiled and
+            # reported again on the next run.
+            if result['problems']:
+                result['status'] = 'failed'
+            else:
+                write_level_cache(get_cache_path(path), data, digest)
+                result['status'] = 'compiled'
+            result['bodies'] = len(data.bodies)
+            result['triangles'] = data.triangle_count
+            result['shapes'] = data.shape_count
+    except Exception:
+        result['status'] = 'failed'
+        result['problems'].append(traceback.format_exc().strip())
+    result['time'] = default_timer() - start
+    return result
+
+def main():
+    parser = OptionParser(usage='cannonball-compile [options] [path ...]')
+    parser.add_option('-j', '--jobs', type='int',
+                      default=multiprocessing.cpu_count(),
+                      help='worker processes [default: %default]')
+    parser.add_option('-f', '--force', action='store_true',
+                      help='compile levels whose cache is current')
+    parser.add_option('-s', '--summary', metavar='FILE',
+                      help='write the results as JSON to FILE')
+    options, args = parser.parse_args()
+    paths = find_levels(args or [content_dir])
+    start = default_timer()
+    pool = multiprocessing.Pool(options.jobs)
+    try:
+        results = []
+        for result in pool.imap_unordered(compile_one,
+                                          [(path, options.force)
+                                           for path in paths]):
+            print >> sys.stderr, '%-9s %s' % (result['status'],
+                                              result['path'])
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+    total_time = default_timer() - start
+
+    results.sort(key=lambda result: result['path'])
+    print '%-40s %-9s %8s' % ('level', 'status', 'seconds')
+    for result in results:
+        print '%-40s %-9s %8.3f' % (os.path.relpath(result['path']),
+                                    result['status'], result['time'])
+        for problem in result['problems']:
+            print '    %s' % problem.replace('\n', '\n    ')
+    statuses = [result['status'] for result in results]
+    print ('%d compiled, %d unchanged, %d failed in %.3f s' %
+           (statuses.count('compiled'), statuses.count('unchanged'),
+            statuses.count('failed'), total_time))
+    if options.summary:
+        f = open(options.summary, 'w')
+        try:
+            json.dump({'results': results, 'time': total_time}, f, indent=2,
+                      sort_keys=True)
+        finally:
+            f.close()
+    if 'failed' in statuses:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
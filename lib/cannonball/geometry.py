@@ -0,0 +1,429 @@
+from __future__ import division
+
+import numpy
+
+from heapq import heappop, heappush
+from math import *
+
+def as_vertex_array(vertices):
+    """
+    >>> as_vertex_array([(1, 2), (3, 4)]).tolist()
+    [[1.0, 2.0], [3.0, 4.0]]
+    >>> as_vertex_array([]).shape
+    (0, 2)
+    """
+    if not isinstance(vertices, numpy.ndarray):
+        vertices = [tuple(v) for v in vertices]
+    return numpy.array(vertices, dtype=numpy.float64).reshape(-1, 2)
+
+def transform_vertices(matrix, vertices):
+    """
+    >>> transform_vertices((1, 0, 0, 1, 3, 4), [(1, 2)]).tolist()
+    [[4.0, 6.0]]
+    """
+    a, b, c, d, e, f = matrix
+    linear = numpy.array([[a, b], [c, d]])
+    return numpy.dot(as_vertex_array(vertices), linear) + (e, f)
+
+def signed_area(vertices):
+    """
+    http://local.wasp.uwa.edu.au/~pbourke/geometry/clockwise/
+
+    >>> signed_area(as_vertex_array([(0, 0), (2, 0), (2, 2), (0, 2)]))
+    4.0
+    """
+    x = vertices[:, 0]
+    y = vertices[:, 1]
+    return (numpy.dot(x, numpy.roll(y, -1)) -
+            numpy.dot(numpy.roll(x, -1), y)) / 2
+
+def remove_duplicates(vertices):
+    if len(vertices) < 2:
+        return vertices
+    keep = (vertices != numpy.roll(vertices, 1, axis=0)).any(axis=1)
+    if not keep.any():
+        return vertices[:1]
+    return vertices[keep]
+
+def unit_edges(vertices):
+    edges = numpy.roll(vertices, -1, axis=0) - vertices
+    lengths = numpy.sqrt((edges ** 2).sum(axis=1))
+    return edges / lengths[:, numpy.newaxis]
+
+def normalize_vertices(vertices, threshold=0.999):
+    """
+    Make the vertices clockwise and remove duplicate and collinear vertices.
+
+    >>> normalize_vertices(as_vertex_array([(0, 0), (2, 0), (2, 0), (2, 2),
+    ...                                     (1, 2), (0, 2)])).tolist()
+    [[0.0, 0.0], [2.0, 0.0], [2.0, 2.0], [0.0, 2.0]]
+    """
+    if signed_area(vertices) < 0:
+        vertices = vertices[::-1]
+    vertices = remove_duplicates(vertices)
+    while len(vertices) > 3:
+        after = unit_edges(vertices)
+        before = numpy.roll(after, 1, axis=0)
+        straight = (before * after).sum(axis=1) > threshold
+        if not straight.any():
+            break
+        if straight.all():
+            straight[0] = False
+
+        # Remove every other vertex of each straight run. The survivors are
+        # tested against their new neighbors in the next pass.
+        index = numpy.arange(len(vertices))
+        run_start = straight & ~numpy.roll(straight, 1)
+        last_start = index[run_start][-1]
+        start = numpy.maximum.accumulate(numpy.where(run_start, index,
+                                                     last_start -
+                                                     len(vertices)))
+        remove = straight & ((index - start) % 2 == 0)
+        vertices = vertices[~remove]
+    return vertices
+
+def vertex_normals(vertices, z=0.001):
+    """
+    Return a unit normal for each vertex, averaged from its two edges and
+    tilted slightly out of the plane for lighting.
+    """
+    after = unit_edges(vertices)
+    before = numpy.roll(after, 1, axis=0)
+    normals = numpy.empty((len(vertices), 3))
+    normals[:, 0] = before[:, 1] + after[:, 1]
+    normals[:, 1] = -before[:, 0] - after[:, 0]
+    lengths = numpy.sqrt((normals[:, :2] ** 2).sum(axis=1))
+    lengths[lengths == 0] = 1
+    normals[:, :2] /= lengths[:, numpy.newaxis]
+    normals[:, 2] = z
+    lengths = numpy.sqrt((normals ** 2).sum(axis=1))
+    return normals / lengths[:, numpy.newaxis]
+
+def triangle_cross(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+def triangle_contains(a, b, c, p):
+    return (triangle_cross(a, b, p) >= 0 and triangle_cross(b, c, p) >= 0 and
+            triangle_cross(c, a, p) >= 0)
+
+class VertexGrid(object):
+    """
+    Uniform grid over a set of vertex indices, for finding the vertices that
+    may lie inside a rectangle.
+    """
+
+    def __init__(self, points, origin, cell_size):
+        self.points = points
+        self.origin = origin
+        self.cell_size = cell_size or 1
+        self.cells = {}
+        self.members = set()
+
+    def cell(self, x, y):
+        return (int(floor((x - self.origin[0]) / self.cell_size)),
+                int(floor((y - self.origin[1]) / self.cell_size)))
+
+    def add(self, index):
+        x, y = self.points[index]
+        self.cells.setdefault(self.cell(x, y), set()).add(index)
+        self.members.add(index)
+
+    def remove(self, index):
+        x, y = self.points[index]
+        self.cells[self.cell(x, y)].discard(index)
+        self.members.discard(index)
+
+    def query(self, min_x, min_y, max_x, max_y):
+        min_i, min_j = self.cell(min_x, min_y)
+        max_i, max_j = self.cell(max_x, max_y)
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self.members):
+            return self.members
+        result = []
+        for i in xrange(min_i, max_i + 1):
+            for j in xrange(min_j, max_j + 1):
+                cell = self.cells.get((i, j))
+                if cell:
+                    result.extend(cell)
+        return result
+
+def triangulate_vertices(vertices):
+    """
+    Triangulate a clockwise polygon by ear clipping and return vertex index
+    triples.
+
+    The remaining vertices form a doubly linked ring. Candidate ears wait in
+    a heap, smallest first, and only the neighbors of a clipped ear are
+    tested again. Only non-convex vertices can block an ear, so they are kept
+    in a grid and only those near a candidate ear are tested. A blocked ear
+    is queued again when the vertex that blocked it is clipped or becomes
+    convex. Collinear vertices are dropped without emitting a triangle. If
+    no ear can be found, as for self-intersecting input, a convex vertex is
+    clipped anyway so that triangulation always finishes.
+
+    >>> triangulate_vertices(as_vertex_array([(0, 0), (2, 0), (2, 2),
+    ...                                       (1, 2), (0, 2)]))
+    [(4, 0, 1), (4, 1, 2)]
+    """
+    n = len(vertices)
+    if n < 3:
+        return []
+    points = vertices.tolist()
+    prev = [i - 1 for i in xrange(n)]
+    prev[0] = n - 1
+    succ = [i + 1 for i in xrange(n)]
+    succ[-1] = 0
+    linked = [True] * n
+    versions = [0] * n
+
+    min_x, min_y = vertices.min(axis=0).tolist()
+    max_x, max_y = vertices.max(axis=0).tolist()
+    size = max(max_x - min_x, max_y - min_y)
+    epsilon = 1e-12 * size ** 2
+    grid = VertexGrid(points, (min_x, min_y), size / sqrt(n))
+    heap = []
+
+    # Ears blocked by each non-convex vertex, with their versions.
+    blocked = {}
+
+    def cross(i):
+        return triangle_cross(points[prev[i]], points[i], points[succ[i]])
+
+    def get_blocker(i):
+        a = points[prev[i]]
+        b = points[i]
+        c = points[succ[i]]
+        for j in grid.query(min(a[0], b[0], c[0]), min(a[1], b[1], c[1]),
+                            max(a[0], b[0], c[0]), max(a[1], b[1], c[1])):
+            p = points[j]
+            if (j != prev[i] and j != succ[i] and p != a and p != b and
+                p != c and triangle_contains(a, b, c, p)):
+                return j
+        return None
+
+    def unblock(j):
+        grid.remove(j)
+        for i, version in blocked.pop(j, ()):
+            if linked[i] and version == versions[i]:
+                update(i)
+
+    def update(i):
+        versions[i] += 1
+        area = cross(i)
+        if area <= epsilon:
+            if i not in grid.members:
+                grid.add(i)
+        elif i in grid.members:
+            unblock(i)
+        if abs(area) <= epsilon:
+            heappush(heap, (-1, versions[i], i))
+        elif area > epsilon:
+            a = points[prev[i]]
+            b = points[i]
+            c = points[succ[i]]
+            key = (max(a[0], b[0], c[0]) - min(a[0], b[0], c[0]) +
+                   max(a[1], b[1], c[1]) - min(a[1], b[1], c[1]))
+            heappush(heap, (key, versions[i], i))
+
+    triangles = []
+    remaining = n
+
+    def clip(i):
+        p = prev[i]
+        q = succ[i]
+        if cross(i) > epsilon:
+            triangles.append((p, i, q))
+        succ[p] = q
+        prev[q] = p
+        linked[i] = False
+        if i in grid.members:
+            unblock(i)
+        update(p)
+        update(q)
+
+    for i in xrange(n):
+        update(i)
+    while remaining > 3:
+        if not heap:
+            # No ear anywhere. Clip a convex vertex anyway.
+            ring = [i for i in xrange(n) if linked[i]]
+            convex = [i for i in ring if cross(i) > epsilon]
+            clip((convex or ring)[0])
+            remaining -= 1
+            continue
+        key, version, i = heappop(heap)
+        if not linked[i] or version != versions[i]:
+            continue
+        j = None if key < 0 else get_blocker(i)
+        if j is None:
+            clip(i)
+            remaining -= 1
+        else:
+            blocked.setdefault(j, []).append((i, version))
+    i = linked.index(True)
+    if cross(i) > epsilon:
+        triangles.append((prev[i], i, succ[i]))
+    return triangles
+
+def merge_convex(vertices, triangles, max_vertices=8):
+    """
+    Merge triangles into convex pieces of at most `max_vertices` vertices
+    with the Hertel-Mehlhorn algorithm, shortest diagonal first, and return
+    vertex index tuples.
+
+    >>> merge_convex(as_vertex_array([(0, 0), (2, 0), (2, 2), (0, 2)]),
+    ...              [(3, 0, 1), (3, 1, 2)])
+    [(3, 0, 1, 2)]
+    """
+    points = vertices.tolist()
+    pieces = dict(enumerate(list(t) for t in triangles))
+    owners = {}
+    for index, piece in pieces.iteritems():
+        for a, b in zip(piece, piece[1:] + piece[:1]):
+            owners[a, b] = index
+
+    def length(edge):
+        (x1, y1), (x2, y2) = points[edge[0]], points[edge[1]]
+        return (x2 - x1) ** 2 + (y2 - y1) ** 2
+
+    diagonals = [(a, b) for a, b in owners if (b, a) in owners and a < b]
+    diagonals.sort(key=length)
+    for a, b in diagonals:
+        p = owners[a, b]
+        q = owners[b, a]
+        if len(pieces[p]) + len(pieces[q]) - 2 > max_vertices:
+            continue
+
+        # Rotate p to run from b to a, and q to run from a to b.
+        piece_p = pieces[p]
+        i = piece_p.index(b)
+        piece_p = piece_p[i:] + piece_p[:i]
+        piece_q = pieces[q]
+        i = piece_q.index(a)
+        piece_q = piece_q[i:] + piece_q[:i]
+        if (triangle_cross(points[piece_p[-2]], points[a],
+                           points[piece_q[1]]) <= 0 or
+            triangle_cross(points[piece_q[-2]], points[b],
+                           points[piece_p[1]]) <= 0):
+            continue
+
+        merged = piece_p + piece_q[1:-1]
+        del owners[a, b]
+        del owners[b, a]
+        for c, d in zip(piece_q, piece_q[1:] + piece_q[:1]):
+            if (c, d) in owners:
+                owners[c, d] = p
+        pieces[p] = merged
+        del pieces[q]
+    return [tuple(pieces[i]) for i in sorted(pieces)]
+
+def cubic_bezier_points(p0, p1, p2, p3, steps=10):
+    """
+    Evaluate a cubic Bezier curve at `steps` evenly spaced parameters,
+    excluding the start point.
+
+    >>> cubic_bezier_points((0, 0), (0, 1), (1, 1), (1, 0), 2).tolist()
+    [[0.5, 0.75], [1.0, 0.0]]
+    """
+    t = numpy.arange(1, steps + 1)[:, numpy.newaxis] / steps
+    u = 1 - t
+    return (u ** 3 * p0 + 3 * u ** 2 * t * p1 + 3 * u * t ** 2 * p2 +
+            t ** 3 * p3)
+
+def flatten_cubic(p0, p1, p2, p3, tolerance, max_depth=16):
+    """
+    Flatten a cubic Bezier curve by recursive subdivision until every piece
+    is within `tolerance` of its chord, and return the end points of the
+    pieces, excluding the start point.
+
+    >>> flatten_cubic((0, 0), (1, 0), (2, 0), (3, 0), 0.1).tolist()
+    [[3.0, 0.0]]
+    >>> len(flatten_cubic((0, 0), (0, 1), (1, 1), (1, 0), 0.01))
+    16
+    """
+    points = []
+    limit = 16 * tolerance ** 2
+    stack = [(p0, p1, p2, p3, 0)]
+    while stack:
+        p0, p1, p2, p3, depth = stack.pop()
+        (x0, y0), (x1, y1), (x2, y2), (x3, y3) = p0, p1, p2, p3
+
+        # Bound the distance between the curve and its chord.
+        ux = max((3 * x1 - 2 * x0 - x3) ** 2, (3 * x2 - x0 - 2 * x3) ** 2)
+        uy = max((3 * y1 - 2 * y0 - y3) ** 2, (3 * y2 - y0 - 2 * y3) ** 2)
+        if ux + uy <= limit or depth >= max_depth:
+            points.append(p3)
+        else:
+            x01, y01 = (x0 + x1) / 2, (y0 + y1) / 2
+            x12, y12 = (x1 + x2) / 2, (y1 + y2) / 2
+            x23, y23 = (x2 + x3) / 2, (y2 + y3) / 2
+            x012, y012 = (x01 + x12) / 2, (y01 + y12) / 2
+            x123, y123 = (x12 + x23) / 2, (y12 + y23) / 2
+            mid = (x012 + x123) / 2, (y012 + y123) / 2
+            stack.append((mid, (x123, y123), (x23, y23), p3, depth + 1))
+            stack.append((p0, (x01, y01), (x012, y012), mid, depth + 1))
+    return as_vertex_array(points)
+
+def polygon_distance(vertices, point):
+    """
+    Return the distance from a point to a convex polygon with vertices in
+    counter-clockwise order, or 0 if the point is inside.
+
+    >>> square = [(0, 0), (2, 0), (2, 2), (0, 2)]
+    >>> polygon_distance(square, (1, 1))
+    0
+    >>> polygon_distance(square, (5, 1))
+    3.0
+    >>> polygon_distance(square, (5, 6))
+    5.0
+    """
+    x, y = point
+    inside = True
+    distance = None
+    for i in xrange(len(vertices)):
+        x1, y1 = vertices[i - 1]
+        x2, y2 = vertices[i]
+        dx, dy = x2 - x1, y2 - y1
+        if dx * (y - y1) - dy * (x - x1) < 0:
+            inside = False
+        length_squared = dx * dx + dy * dy
+        t = 0
+        if length_squared:
+            t = min(max(((x - x1) * dx + (y - y1) * dy) / length_squared, 0),
+                    1)
+        edge_distance = hypot(x - x1 - t * dx, y - y1 - t * dy)
+        if distance is None or edge_distance < distance:
+            distance = edge_distance
+    return 0 if inside else distance
+
+def cluster_circles(circles):
+    """
+    Group overlapping circles, given as (x, y, radius), transitively.
+    Return lists of indices, in order.
+
+    >>> cluster_circles([(0, 0, 1), (5, 0, 1), (1.5, 0, 1), (3, 0, 1)])
+    [[0, 1, 2, 3]]
+    >>> cluster_circles([(0, 0, 1), (5, 0, 1), (1.5, 0, 1)])
+    [[0, 2], [1]]
+    """
+    parents = range(len(circles))
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+    for i, (x1, y1, r1) in enumerate(circles):
+        for j in xrange(i):
+            x2, y2, r2 = circles[j]
+            if hypot(x2 - x1, y2 - y1) <= r1 + r2:
+                parents[find(i)] = find(j)
+    clusters = {}
+    for i in xrange(len(circles)):
+        clusters.setdefault(find(i), []).append(i)
+    return sorted(clusters.itervalues())
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,86 @@
+"""
+Load and step a level without a window or GL context.
+
+Run with `python -m cannonball.headless <level>` to simulate a level at
+full CPU speed, for profiling, soak tests and batch runs, or with
+`--replay <file>` to replay a recording made with `cannonball --record`.
+The digest printed at the end is the same for identical runs.
+"""
+
+from __future__ import division
+
+import pyglet
+
+# Nothing is drawn, so do not open a hidden window for sharing GL objects.
+pyglet.options['shadow_window'] = False
+
+from cannonball.Level import *
+from cannonball.Recording import *
+
+from optparse import OptionParser
+import sys
+from timeit import default_timer
+
+def run(level, seconds, dt=1 / 60, replay=None):
+    """
+    Step a level for the given number of simulated seconds, until the
+    cannonball wins or is lost, or until the replay ends. Return the number
+    of steps.
+    """
+    steps = 0
+    while steps * dt < seconds:
+        cannonball = level.actors.get('cannonball')
+        if not cannonball or cannonball.won:
+            break
+        if replay and not replay.replay(cannonball, steps):
+            break
+        level.step(dt)
+        level.profiler.next_frame()
+        steps += 1
+    return steps
+
+def main():
+    parser = OptionParser(usage='python -m cannonball.headless [options] '
+                                '<level>')
+    parser.add_option('-s', '--seconds', type='float', default=60,
+                      help='simulated seconds to run [default: %default]')
+    parser.add_option('--replay', metavar='FILE',
+                      help='replay input recorded in FILE until it ends')
+    parser.add_option('--seed', type='int', default=0,
+                      help='seed for the random number generator '
+                           '[default: %default]')
+    parser.add_option('--profile', metavar='FILE',
+                      help='write step phase timings to FILE as JSON lines')
+    options, args = parser.parse_args()
+    replay = None
+    dt = 1 / 60
+    if options.replay:
+        replay = load_recording(options.replay)
+        args = args or [replay.level_path]
+        options.seed = replay.seed
+        options.seconds = float('inf')
+        dt = replay.dt
+    if len(args) != 1:
+        parser.print_usage()
+        sys.exit(1)
+    start = default_timer()
+    level = Level(args[0], seed=options.seed)
+    level.create_cannonball()
+    load_time = default_timer() - start
+    start = default_timer()
+    steps = run(level, options.seconds, dt, replay)
+    step_time = default_timer() - start
+    print 'Loaded in %.3f s' % load_time
+    print level.get_memory_report()
+    print 'Stepped %d times in %.3f s (%.0f steps/s)' % (
+        steps, step_time, steps / max(step_time, 1e-9))
+    print 'State digest: %s' % get_state_digest(level)
+    if options.profile:
+        f = open(options.profile, 'w')
+        try:
+            level.profiler.dump(f)
+        finally:
+            f.close()
+
+if __name__ == '__main__':
+    main()
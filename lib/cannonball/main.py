@@ -3,6 +3,9 @@ from __future__ import division
 from cannonball.actors.Cannonball import *
 from cannonball.Camera import *
 from cannonball.Level import *
+from cannonball.LevelLoader import *
+from cannonball.Recording import *
+from cannonball.TextureManager import texture_manager
 from cannonball.svg import *
 
 from Box2D import *
@@ -10,13 +13,50 @@ import pyglet
 from pyglet.gl import *
 
 import ctypes
+from optparse import OptionParser
 import os
 import random
 import sys
 
 class CannonballWindow(pyglet.window.Window):
-    def __init__(self, level):
-        self.level = level
+    """
+    The game window.
+
+    Physics runs at a fixed time step. After a slow frame, at most
+    `max_catch_up_steps` steps are run and the rest of the backlog is
+    dropped, so the game slows down instead of falling further behind.
+    Bodies are drawn interpolated between the last two physics steps.
+
+    F3 toggles an overlay with rolling percentiles of the frame phase
+    timings.
+
+    Levels are loaded on a worker thread while the window shows a progress
+    bar.
+    """
+
+    max_catch_up_steps = 5
+
+    # Frames between updates of the profiler overlay.
+    overlay_interval = 30
+
+    def __init__(self, level_path, seed=None, recording_path=None,
+                 replay=None, physics_dt=1 / 60, max_catch_up_steps=None,
+                 profile_path=None, verbose=False):
+        self.level = None
+        self.loader = None
+        self.camera = None
+        self.progress_label = None
+        self.profile_path = profile_path
+        self.verbose = verbose
+        self.overlay = None
+        self.overlay_frame = 0
+        self.replay = replay
+        self.physics_dt = replay.dt if replay else physics_dt
+        if max_catch_up_steps is not None:
+            self.max_catch_up_steps = max_catch_up_steps
+        self.recording_path = recording_path
+        self.recording = None
+        self.tick = 0
         pyglet.window.Window.__init__(self, fullscreen=True,
                                       caption="Cannonball")
         self.set_mouse_visible(False)
@@ -43,26 +83,66 @@ class CannonballWindow(pyglet.window.Window):
         glLightfv(GL_LIGHT1, GL_POSITION, Float4(1, 0, 1, 0))
         glLightfv(GL_LIGHT1, GL_DIFFUSE, Float3(0.2, 0.2, 0.2))
 
-        start = self.level.actors['start']
-        start_shapes = start.body.shapeList
-        start_position = b2Vec2()
-        for shape in start_shapes:
-            start_position += shape.GetCentroid()
-        start_position *= 1 / len(start_shapes)
-        self.create_cannonball(start_position)
+        self.time = 0
+        self.physics_time = 0
+        self.dropped_time = 0
+        self.load_level(level_path, seed)
+        pyglet.clock.schedule(self.step)
 
+    def load_level(self, path, seed=None):
+        """
+        Start loading a level. The current level, if any, is dropped.
+        """
+        self.level = None
+        self.camera = None
+        self.loader = LevelLoader(path, seed)
+
+    def start_level(self, level):
+        self.level = level
+        self.loader = None
+        if self.verbose:
+            print 'Merged %d triangles into %d shapes' % (level.triangle_count,
+                                                          level.shape_count)
+            print level.get_memory_report()
+        self.level.create_cannonball()
         self.camera = Camera(self, self.level)
 
+        # Center the view on the cannonball before the first frame.
+        self.camera.step(0)
+        if self.recording_path:
+            self.recording = Recording(level.path, level.seed,
+                                       self.physics_dt)
+        self.tick = 0
         self.time = 0
         self.physics_time = 0
-        self.physics_dt = 1 / 60 
-        pyglet.clock.schedule_interval(self.step, self.physics_dt)
 
     def step(self, dt):
+        if self.loader:
+            if self.loader.done:
+                self.start_level(self.loader.finish())
+            return
+        if not self.level:
+            return
         self.time += dt
+        steps = 0
         while self.physics_time + self.physics_dt <= self.time:
+            if steps == self.max_catch_up_steps:
+                self.dropped_time += self.time - self.physics_time
+                self.level.profiler.add('dropped', self.time -
+                                        self.physics_time)
+                self.time = self.physics_time
+                break
+            steps += 1
             self.physics_time += self.physics_dt
-            self.camera.step(self.physics_dt)
+            cannonball = self.level.actors.get('cannonball')
+            if self.replay:
+                if not self.replay.replay(cannonball, self.tick):
+                    print 'End of Replay'
+                    self.on_close()
+                    break
+            elif self.recording:
+                self.recording.record(cannonball)
+            self.tick += 1
             self.level.step(self.physics_dt)
  
             cannonball = self.level.actors.get('cannonball')
@@ -74,40 +154,149 @@ class CannonballWindow(pyglet.window.Window):
                 print 'Game Over'
                 self.on_close()
                 break
+        self.level.interpolation = ((self.time - self.physics_time) /
+                                    self.physics_dt)
+        self.camera.step(dt)
 
     def on_draw(self):
+        if not self.level:
+            self.draw_progress()
+            return
         r, g, b = self.level.background_color
         glClearColor(r, g, b, 1)
         self.clear()
         self.camera.draw()
+        if self.overlay:
+            self.draw_overlay()
+
+    def draw_progress(self):
+        glClearColor(0, 0, 0, 1)
+        self.clear()
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        glOrtho(0, self.width, 0, self.height, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        glDisable(GL_LIGHTING)
+        if self.loader:
+            width = self.width // 2
+            x = (self.width - width) // 2
+            y = self.height // 2
+            glColor3d(0.3, 0.3, 0.3)
+            glRectd(x, y - 5, x + width, y + 5)
+            glColor3d(1, 1, 1)
+            glRectd(x, y - 5, x + self.loader.progress * width, y + 5)
+            if self.progress_label is None:
+                self.progress_label = pyglet.text.Label(
+                    '', font_size=12, x=self.width // 2, y=y + 20,
+                    anchor_x='center')
+            self.progress_label.text = self.loader.status
+            self.progress_label.draw()
+        glEnable(GL_LIGHTING)
+
+    def draw_overlay(self):
+        profiler = self.level.profiler
+        if profiler.frame >= self.overlay_frame + self.overlay_interval:
+            self.overlay_frame = profiler.frame
+            self.overlay.text = '\n'.join(profiler.get_summary())
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        glOrtho(0, self.width, 0, self.height, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        glDisable(GL_LIGHTING)
+        self.overlay.draw()
+        glEnable(GL_LIGHTING)
+
+    def toggle_overlay(self):
+        if self.overlay:
+            self.overlay = None
+        else:
+            self.overlay = pyglet.text.Label('', font_name='Courier New',
+                                             font_size=12, x=10,
+                                             y=self.height - 10,
+                                             anchor_y='top', multiline=True,
+                                             width=self.width // 2)
+            self.overlay_frame = -self.overlay_interval
+
+    def flip(self):
+        if not self.level:
+            pyglet.window.Window.flip(self)
+            return
+        profiler = self.level.profiler
+        profiler.start('swap')
+        pyglet.window.Window.flip(self)
+        profiler.stop('swap')
+        profiler.next_frame()
 
     def on_close(self):
+        if self.verbose:
+            print texture_manager.get_report()
+        if self.recording:
+            save_recording(self.recording_path, self.recording)
+            self.recording = None
+        if self.profile_path and self.level:
+            f = open(self.profile_path, 'w')
+            try:
+                self.level.profiler.dump(f)
+            finally:
+                f.close()
+            self.profile_path = None
         self.close()
 
     def on_key_press(self, symbol, modifiers):
         if symbol == pyglet.window.key.ESCAPE:
             self.on_close()
+        if symbol == pyglet.window.key.F3:
+            self.toggle_overlay()
+        if not self.level:
+            return
         self.camera.on_key_press(symbol, modifiers)
         cannonball = self.level.actors.get('cannonball')
-        if cannonball:
+        if cannonball and not self.replay:
             cannonball.on_key_press(symbol, modifiers)
 
     def on_key_release(self, symbol, modifiers):
+        if not self.level:
+            return
         self.camera.on_key_release(symbol, modifiers)
         cannonball = self.level.actors.get('cannonball')
-        if cannonball:
+        if cannonball and not self.replay:
             cannonball.on_key_release(symbol, modifiers)
-
-    def create_cannonball(self, position):
-        actor = Cannonball(self.level)
-        actor.create_body(position)
  
 def main():
-    if len(sys.argv) != 2:
-        print 'Usage: cannonball <level>'
+    parser = OptionParser(usage='cannonball [options] <level>')
+    parser.add_option('--record', metavar='FILE',
+                      help='record input to FILE for replay')
+    parser.add_option('--replay', metavar='FILE',
+                      help='replay input recorded in FILE')
+    parser.add_option('--seed', type='int',
+                      help='seed for the random number generator')
+    parser.add_option('--physics-rate', type='float', default=60,
+                      help='physics steps per second [default: %default]')
+    parser.add_option('--max-catch-up', type='int',
+                      default=CannonballWindow.max_catch_up_steps,
+                      help='physics steps per frame before the game slows '
+                           'down [default: %default]')
+    parser.add_option('--profile', metavar='FILE',
+                      help='write frame phase timings to FILE as JSON lines '
+                           'on exit')
+    parser.add_option('-v', '--verbose', action='store_true',
+                      help='print level and texture statistics')
+    options, args = parser.parse_args()
+    replay = None
+    if options.replay:
+        replay = load_recording(options.replay)
+        args = args or [replay.level_path]
+        options.seed = replay.seed
+    if len(args) != 1:
+        parser.print_usage()
         sys.exit(1)
-    level = Level(sys.argv[1])
-    window = CannonballWindow(level)
+    if options.seed is None:
+        options.seed = random.randrange(1 << 32)
+    window = CannonballWindow(args[0], options.seed, options.record, replay,
+                              1 / options.physics_rate, options.max_catch_up,
+                              options.profile, options.verbose)
     pyglet.app.run()
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+"""
+Memory measurements of the actors and shape data of a level.
+
+The legacy size is measured on a copy of the same data in the layout it
+had before materials were interned and classes got slots: a dictionary per
+actor and mesh record, and a dictionary per shape with its color, texture
+and normals as a list of tuples of floats.
+"""
+
+from __future__ import division
+
+from cannonball.MaterialTable import material_table
+
+import sys
+
+class Record(object):
+    """
+    An object with a dictionary, to copy slotted objects into.
+    """
+
+def get_slots(cls):
+    """
+    >>> class A(object):
+    ...     __slots__ = 'a',
+    >>> class B(A):
+    ...     __slots__ = 'b', 'c'
+    >>> get_slots(B)
+    ['a', 'b', 'c']
+    """
+    slots = []
+    for base in reversed(cls.__mro__):
+        names = base.__dict__.get('__slots__', ())
+        if isinstance(names, basestring):
+            names = names,
+        slots.extend(names)
+    return slots
+
+def get_size(obj):
+    """
+    Return the bytes taken by an object and its dictionary, if it has one.
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def get_legacy_object_size(obj):
+    """
+    Return the bytes that an object would take without slots.
+
+    >>> class Point(object):
+    ...     __slots__ = 'x', 'y'
+    ...     def __init__(self, x, y):
+    ...         self.x, self.y = x, y
+    >>> get_legacy_object_size(Point(1, 2)) > get_size(Point(1, 2))
+    True
+    """
+    record = Record()
+    for name in get_slots(type(obj)):
+        if hasattr(obj, name):
+            setattr(record, name, getattr(obj, name))
+    return get_size(record)
+
+def get_normal_counts(actor):
+    """
+    Return the number of normals of each shape of an actor by the start of
+    its normals in the actor's array.
+    """
+    starts = sorted(shape.GetUserData()[1] for shape in actor.body.shapeList
+                    if shape.GetUserData()[1] is not None)
+    ends = starts[1:] + [len(actor.normals)]
+    return dict((start, end - start) for start, end in zip(starts, ends))
+
+def get_level_size(level):
+    """
+    Return the bytes taken by the actors of a level, their mesh records,
+    the user data of their shapes and their normals.
+    """
+    size = 0
+    for actor in level.actors.itervalues():
+        size += get_size(actor)
+        size += sum(get_size(mesh) for mesh in actor.meshes)
+        if actor.normals is not None:
+            size += actor.normals.nbytes
+        for shape in actor.body.shapeList:
+            size += sys.getsizeof(shape.GetUserData())
+    return size
+
+def get_legacy_level_size(level):
+    """
+    Return the bytes that the data measured by `get_level_size` takes when
+    copied into the legacy layout.
+    """
+    size = 0
+    for actor in level.actors.itervalues():
+        size += get_legacy_object_size(actor)
+        size += sum(get_legacy_object_size(mesh) for mesh in actor.meshes)
+        normals = actor.normals.tolist() if actor.normals is not None else []
+        counts = get_normal_counts(actor) if actor.normals is not None else {}
+        for shape in actor.body.shapeList:
+            material_id, normals_start = shape.GetUserData()
+            material = material_table[material_id]
+            shape_normals = None
+            if normals_start is not None:
+                end = normals_start + counts[normals_start]
+                shape_normals = map(tuple, normals[normals_start:end])
+            user_data = {'color': material.color, 'texture': material.texture,
+                         'normals': shape_normals}
+            size += sys.getsizeof(user_data)
+            if shape_normals is not None:
+                size += sys.getsizeof(shape_normals)
+                for normal in shape_normals:
+                    size += sys.getsizeof(normal)
+                    size += sum(sys.getsizeof(c) for c in normal)
+    return size
+
+def get_memory_report(level):
+    size = get_level_size(level)
+    legacy_size = get_legacy_level_size(level)
+    shape_count = sum(1 for actor in level.actors.itervalues()
+                      for shape in actor.body.shapeList)
+    return ('%d actors, %d shapes, %d materials: %.1f KB of actor and shape '
+            'data, %.1f KB with dictionaries, %.1f KB saved' %
+            (len(level.actors), shape_count, len(material_table), size / 1024,
+             legacy_size / 1024, (legacy_size - size) / 1024))
@@ -1,5 +1,9 @@
 from __future__ import division
 
+from cannonball.geometry import *
+
+import numpy
+
 from math import *
 import re
 
@@ -7,6 +11,8 @@ class SVGError(Exception):
     pass
 
 class Vector(object):
+    __slots__ = '__comps',
+
     def __init__(self, comps):
         self.__comps = tuple(comps)
 
@@ -65,7 +71,7 @@ class Vector(object):
 
     def perp(self):
         """
-        >>> Vector([1, 2]).perp
+        >>> Vector([1, 2]).perp()
         Vector([2, -1])
         """
         x, y = self
@@ -76,18 +82,19 @@ class Vector(object):
 
 class Polygon(object):
     def __init__(self, vertices):
-        self.vertices = [Vector(v) for v in vertices]
-        if self.vertices[-1] == self.vertices[0]:
-            self.vertices.pop()
+        self.array = as_vertex_array(vertices)
+        if len(self.array) > 1 and (self.array[-1] == self.array[0]).all():
+            self.array = self.array[:-1]
+
+    @property
+    def vertices(self):
+        return [Vector(v) for v in self.array.tolist()]
 
     def contains(self, point):
-        if len(self.vertices) != 3:
+        if len(self.array) != 3:
             raise SVGError('only implemented for triangles')
-        p1, p2, p3 = self.vertices
-        for a, b in [(p1, p2), (p2, p3), (p3, p1)]:
-            if Polygon([a, b, point]).area < 0:
-                return False
-        return True
+        a, b, c = self.array.tolist()
+        return triangle_contains(a, b, c, tuple(point))
 
     def __repr__(self):
         return 'Polygon(%r)' % self.vertices
@@ -97,79 +104,45 @@ class Polygon(object):
         return self.area >= 0
 
     def normalize(self):
-        vertices = list(self.vertices)
-        if not self.clockwise:
-            vertices.reverse()
-        i = 0
-        while i < len(vertices):
-            before = vertices[i] - vertices[(i - 1) % len(vertices)]
-            after = vertices[(i + 1) % len(vertices)] - vertices[i]
-            if before.norm().dot(after.norm()) > 0.999:
-                del vertices[i]
-            else:
-                i += 1
-        return Polygon(vertices)
+        return Polygon(normalize_vertices(self.array))
+
+    def normals(self):
+        return vertex_normals(self.array)
+
+    def __len__(self):
+        return len(self.array)
 
     def __iter__(self):
         return iter(self.vertices)
 
     @property
     def area(self):
-        """
-        http://local.wasp.uwa.edu.au/~pbourke/geometry/clockwise/
-        """
-        result = 0
-        for i in xrange(len(self.vertices)):
-            j = (i + 1) % len(self.vertices)
-            x, y = self.vertices[i]
-            nx, ny = self.vertices[j]
-            result += x * ny - nx * y
-        return result / 2.0
+        return float(signed_area(self.array))
 
     def triangulate(self):
-        vertices = list(self.vertices)
+        vertices = self.vertices
+        return [Polygon([vertices[i] for i in triangle])
+                for triangle in self.triangle_indices()]
+
+    def triangle_indices(self):
         if not self.clockwise:
             raise SVGError('Cannot triangulate counter-clockwise polygon')
-        triangles = []
-        while len(vertices) >= 3:
-            for i in xrange(len(vertices)):
-                triangle = Polygon([vertices[(i - 1) % len(vertices)],
-                                    vertices[i],
-                                    vertices[(i + 1) % len(vertices)]])
-                if triangle.clockwise and all(not triangle.contains(v)
-                                              for v in vertices
-                                              if v not in triangle.vertices):
-                    del vertices[i]
-                    triangles.append(triangle)
-                    break
-            else:
-                raise SVGError('Cannot triangulate polygon')
-        return triangles
-
-def bezier_points(points, steps=10):
-    """
-    http://www.niksula.cs.hut.fi/~hkankaan/Homepages/bezierfast.html
-    """
-
-    t = 1 / steps
-    t2 = t ** 2
-
-    p0, p1, p2, p3 = points
-    f = p0
-    fd = 3 * (p1 - p0) * t
-    fdd_per_2 = 3 * (p0 - 2 * p1 + p2) * t2
-    fddd_per_2 = 3 * (3 * (p1 - p2) + p3 - p0) * t2 * t
+        return triangulate_vertices(self.array)
 
-    fddd = fddd_per_2 + fddd_per_2
-    fdd = fdd_per_2 + fdd_per_2
-    fddd_per_6 = fddd_per_2 * (1 / 3)
+    def convex_indices(self, max_vertices=8):
+        return merge_convex(self.array, self.triangle_indices(),
+                            max_vertices)
 
-    for x in xrange(steps):
-        f += fd + fdd_per_2 + fddd_per_6
-        yield f
-        fd += fdd + fddd_per_2
-        fdd += fddd
-        fdd_per_2 += fddd_per_2
+def bezier_points(points, tolerance=None, steps=10):
+    """
+    Return points along a cubic Bezier curve as an array, excluding the
+    start point. With a tolerance, the curve is flattened adaptively to
+    within that distance. Otherwise, `steps` evenly spaced points are used.
+    """
+    p0, p1, p2, p3 = [tuple(p) for p in points]
+    if tolerance:
+        return flatten_cubic(p0, p1, p2, p3, tolerance)
+    return cubic_bezier_points(p0, p1, p2, p3, steps)
 
 class Color(object):
     def __init__(self, s):
@@ -228,27 +201,28 @@ class Subpath(object):
     def __str__(self):
         return ' '.join(str(c) for c in self.commands)
 
-    def linearize(self):
-        vertices = []
-        start_point = Vector([0, 0])
+    def linearize(self, tolerance=None):
+        chunks = []
+        start_point = 0, 0
         for command in self.commands:
-            if command.name == 'M':
-                start_point = Vector(command.args)
-                vertices.append(command.args)
-            elif command.name == 'L':
-                start_point = Vector(command.args)
-                vertices.append(command.args)
+            if command.name in ('M', 'L'):
+                start_point = tuple(command.args[0:2])
+                chunks.append(as_vertex_array([start_point]))
             elif command.name == 'C':
-                control_points = [start_point, Vector(command.args[0:2]),
-                                  Vector(command.args[2:4]),
-                                  Vector(command.args[4:6])]
-                vertices.extend(bezier_points(control_points))
+                control_points = [start_point, tuple(command.args[0:2]),
+                                  tuple(command.args[2:4]),
+                                  tuple(command.args[4:6])]
+                chunks.append(bezier_points(control_points, tolerance))
                 start_point = control_points[-1]
             elif command.name == 'z':
                 pass
-        return Polygon(vertices)
+        if not chunks:
+            return Polygon([])
+        return Polygon(numpy.concatenate(chunks))
 
 class Command(object):
+    __slots__ = 'name', 'args'
+
     def __init__(self, name, args):
         self.name = name
         self.args = list(float(a) for a in args)
@@ -329,6 +303,10 @@ class Transform(object):
 
     def __mul__(self, other):
         a, b, c, d, e, f = self.matrix
+        if isinstance(other, Polygon):
+            return Polygon(transform_vertices(self.matrix, other.array))
+        if isinstance(other, numpy.ndarray):
+            return transform_vertices(self.matrix, other)
         try:
             x, y = other
             return type(other)((a * x + c * y + e, b * x + d * y + f))
@@ -342,6 +320,19 @@ class Transform(object):
             f3 = b * e2 + d * f2 + f
             return Transform((a3, b3, c3, d3, e3, f3))
 
+    @property
+    def max_scale(self):
+        """
+        The largest factor by which the transform stretches a distance.
+
+        >>> parse_transform('scale(2, -3) rotate(30)').max_scale
+        3.0
+        """
+        a, b, c, d, e, f = self.matrix
+        half_sum = (a ** 2 + b ** 2 + c ** 2 + d ** 2) / 2
+        det = a * d - b * c
+        return sqrt(half_sum + sqrt(max(half_sum ** 2 - det ** 2, 0)))
+
     def __repr__(self):
         return 'Transform((%g, %g, %g, %g, %g, %g))' % self.matrix
 